@@ -6,16 +6,123 @@ import os
 from bs4 import BeautifulSoup
 from datetime import datetime
 import time
-from messaging import send_whatsapp, send_sms, send_email
+from config import get_setting
+from dispatcher import Dispatcher, breaker_states
+from send_queue import SendQueue
+from jobs import get_job_manager
+from metrics import registry
+from delivery_log import get_delivery_log
+from suppression import get_recipient_index, SUPPRESSED, BOUNCED
+from contacts import ContactStore
+from generator import build_messages, build_messages_from_chunks, message_records
+from scheduler import schedule_campaign
+from scraper import crawl_into_store
+from sms_planner import SEGMENT_COSTS, prepare_sms, plan_sms
 
-# Hardcoded API Keys
-TEXTBEE_API_KEY = st.secrets["TEXTBEE_API_KEY"]
-RESEND_API_KEY = st.secrets["RESEND_API_KEY"]
-GREENAPI_INSTANCE_ID = st.secrets["GREENAPI_INSTANCE_ID"]
-GREENAPI_API_TOKEN = st.secrets["GREENAPI_API_TOKEN"]
-TWILIO_SID = st.secrets["TWILIO_SID"]
-TWILIO_AUTH_TOKEN = st.secrets["TWILIO_AUTH_TOKEN"]
-TWILIO_PHONE_NUMBER = st.secrets["TWILIO_PHONE_NUMBER"]
+# API keys, from the environment, .env or .streamlit/secrets.toml
+TEXTBEE_API_KEY = get_setting("TEXTBEE_API_KEY")
+RESEND_API_KEY = get_setting("RESEND_API_KEY")
+GREENAPI_INSTANCE_ID = get_setting("GREENAPI_INSTANCE_ID")
+GREENAPI_API_TOKEN = get_setting("GREENAPI_API_TOKEN")
+TWILIO_SID = get_setting("TWILIO_SID")
+TWILIO_AUTH_TOKEN = get_setting("TWILIO_AUTH_TOKEN")
+TWILIO_PHONE_NUMBER = get_setting("TWILIO_PHONE_NUMBER")
+
+# Compact per-provider latency and throughput table
+def show_provider_metrics():
+    rows = registry.snapshot()
+    if not rows:
+        return
+    metrics_df = pd.DataFrame(rows)
+    for column in ["p50", "p95", "p99"]:
+        metrics_df[column] = (metrics_df[column] * 1000).round(0)
+    metrics_df["msg_per_sec"] = metrics_df["msg_per_sec"].round(2)
+    st.caption("Provider metrics (latency in ms, rate over the last minute)")
+    st.dataframe(metrics_df.rename(columns={"p50": "p50 ms", "p95": "p95 ms", "p99": "p99 ms"}), hide_index=True)
+    tripped = [provider for provider, state in breaker_states().items() if state != "closed"]
+    if tripped:
+        st.warning(f"Circuit open for {', '.join(tripped)}: sends are parked as dead letters until it recovers")
+
+# Show a snapshot of a background send job's progress; while it runs, the
+# page is rerun once it has finished rendering so the snapshot refreshes
+def show_job_progress(campaign):
+    progress = get_job_manager().progress(campaign)
+    if progress is None:
+        return None
+    
+    done = progress["sent"] + progress["failed"]
+    sent_col, failed_col, rate_col, eta_col = st.columns(4)
+    sent_col.metric("Sent", progress["sent"])
+    failed_col.metric("Failed", progress["failed"])
+    rate_col.metric("Rate", f"{progress['rate']:.1f}/s")
+    eta = progress["eta_seconds"]
+    eta_col.metric("ETA", "-" if eta is None else f"{int(eta // 60)}m {int(eta % 60)}s")
+    st.progress(min(1.0, done / progress["total"]) if progress["total"] else 1.0,
+                text=f"{done} of {progress['total']} processed ({progress['state']})")
+    if progress["error"]:
+        st.error(f"Send job stopped: {progress['error']}")
+    if progress["recent_errors"]:
+        st.caption("Recent errors")
+        st.dataframe(pd.DataFrame(progress["recent_errors"]), hide_index=True)
+    show_provider_metrics()
+    
+    if progress["state"] == "running":
+        st.session_state.poll_jobs = True
+    return progress
+
+# The page reruns every second while a job runs, so the plan is only
+# recomputed when the messages or the plan options change
+@st.cache_data(max_entries=8, show_spinner=False)
+def cached_sms_plan(messages, provider, transliterate, short_template, max_segments, segment_cost):
+    planned = prepare_sms(messages, transliterate=transliterate, short_template=short_template,
+                          max_segments=max_segments)
+    return planned, plan_sms(planned, provider=provider, segment_cost=segment_cost)
+
+# Segment, duration and cost projection for the SMS part of a campaign,
+# returning the messages with any chosen SMS-only rewrites applied
+def show_sms_plan(messages, provider):
+    with st.expander("SMS Plan", expanded=True):
+        transliterate = st.checkbox("Transliterate to GSM-7 where possible",
+                                    help="Non-Latin scripts force UCS-2, which fits only 70 characters per segment")
+        short_template = st.text_input("Shorter template for long SMS (optional)",
+                                       help="Used, translated, for SMS that would exceed the segment budget")
+        max_segments = st.number_input("Segments allowed per SMS", min_value=1, value=1)
+        segment_cost = st.number_input("Cost per segment (USD)", min_value=0.0, format="%.4f",
+                                       value=SEGMENT_COSTS.get(provider, 0.0))
+        
+        planned, plan = cached_sms_plan(messages, provider, transliterate, short_template, max_segments,
+                                        segment_cost)
+        sms_col, segments_col, ucs2_col, duration_col, cost_col = st.columns(5)
+        sms_col.metric("SMS", plan["messages"])
+        segments_col.metric("Segments", plan["segments"])
+        ucs2_col.metric("UCS-2", plan["ucs2"])
+        duration = plan["duration_seconds"] or 0
+        duration_col.metric("Send time", f"{int(duration // 60)}m {int(duration % 60)}s")
+        cost_col.metric("Cost", f"${plan['cost']:.2f}")
+        if plan["multipart"]:
+            st.caption(f"{plan['multipart']} SMS need more than one segment")
+        st.dataframe(plan["by_language"], hide_index=True)
+    return planned
+
+# Dispatcher for the SMS service picked on the page, with the configured Twilio credentials
+def make_dispatcher(sms_service):
+    if sms_service == "Twilio":
+        return Dispatcher(
+            sms_service="twilio",
+            sms_kwargs={
+                "twilio_sid": TWILIO_SID,
+                "twilio_token": TWILIO_AUTH_TOKEN,
+                "twilio_number": TWILIO_PHONE_NUMBER
+            }
+        )
+    return Dispatcher(sms_service=(sms_service or "textbelt").lower())
+
+# Due time of queued messages for display; messages due at 0 go out immediately
+def format_due(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M") if timestamp else "now"
+
+# Set by show_job_progress while a job it shows is still running
+st.session_state.poll_jobs = False
 
 # App title and description
 st.title("International Outreach Agent")
@@ -24,19 +131,6 @@ st.write("Automatically send personalized multilingual greetings via WhatsApp, S
 # Sidebar for navigation
 page = st.sidebar.selectbox("Select a page", ["Contact Collection", "Message Generation", "Send Messages", "Schedule"])
 
-# Function to translate text
-def translate_text(text, target_lang):
-    url = "https://libretranslate.de/translate"
-    data = {
-        "q": text,
-        "source": "auto",
-        "target": target_lang
-    }
-    response = requests.post(url, data=data)
-    if response.status_code == 200:
-        return response.json()["translatedText"]
-    return text
-
 # Contact Collection Page
 if page == "Contact Collection":
     st.header("Contact Collection")
@@ -46,11 +140,32 @@ if page == "Contact Collection":
     
     if upload_option == "Upload CSV":
         uploaded_file = st.file_uploader("Upload a CSV file with contacts", type=["csv"])
+        append = st.checkbox("Add to existing contacts instead of replacing them")
         if uploaded_file is not None:
-            contacts_df = pd.read_csv(uploaded_file)
-            st.session_state.contacts = contacts_df
-            st.write(contacts_df)
-            st.success("Contacts loaded successfully!")
+            store = ContactStore()
+            # Only ingest each upload once; Streamlit reruns the script on every interaction
+            upload_key = (uploaded_file.name, uploaded_file.size, append)
+            if st.session_state.get("ingested_upload") != upload_key:
+                stats = store.ingest_csv(uploaded_file, replace=not append)
+                st.session_state.ingested_upload = upload_key
+                st.session_state.ingest_stats = stats
+                # Generation reads the store chunk by chunk instead of a copy in memory
+                st.session_state.contact_source = "store"
+                st.session_state.pop("contacts", None)
+            
+            stats = st.session_state.ingest_stats
+            st.success(
+                f"Contacts loaded successfully! {stats['added']} added from {stats['rows']} rows "
+                f"({stats['invalid']} without a valid email or phone, {stats['duplicates']} duplicates)"
+            )
+            
+            # Paginated preview instead of rendering the whole list
+            total = store.count()
+            page_size = 50
+            page_count = max(1, -(-total // page_size))
+            page_number = st.number_input(f"Preview page (of {page_count})", min_value=1, max_value=page_count, value=1)
+            st.dataframe(store.page(page_number - 1, page_size))
+            store.close()
     
     elif upload_option == "Manual Entry":
         st.subheader("Add Contact Manually")
@@ -78,6 +193,7 @@ if page == "Contact Collection":
                 })
                 
                 st.session_state.contacts = pd.concat([st.session_state.contacts, new_contact], ignore_index=True)
+                st.session_state.contact_source = "manual"
                 st.success(f"Contact {name} added successfully!")
         
         if "contacts" in st.session_state:
@@ -110,12 +226,39 @@ if page == "Contact Collection":
                     st.warning("No email addresses found on this page.")
             except Exception as e:
                 st.error(f"Error scraping website: {e}")
+        
+        st.subheader("Crawl a Site")
+        seed_text = st.text_area("Start URLs (one per line)")
+        max_depth = st.number_input("Link depth to follow", min_value=0, max_value=5, value=1)
+        max_pages = st.number_input("Maximum pages", min_value=1, max_value=10000, value=100)
+        same_domain = st.checkbox("Stay on the start URLs' domains", value=True)
+        
+        seed_urls = [line.strip() for line in seed_text.splitlines() if line.strip()]
+        if st.button("Crawl and Collect Contacts") and seed_urls:
+            store = ContactStore()
+            progress = st.empty()
+            # Contacts are stored page by page as the crawl progresses
+            stats = crawl_into_store(
+                seed_urls,
+                store,
+                on_page=lambda page_url, stats: progress.write(
+                    f"Crawled {stats['pages']} pages, found {stats['found']} contacts, "
+                    f"{stats['added']} new. Last: {page_url}"
+                ),
+                max_depth=max_depth,
+                max_pages=max_pages,
+                same_domain=same_domain
+            )
+            st.session_state.contact_source = "store"
+            st.session_state.pop("contacts", None)
+            store.close()
+            st.success(f"Crawl finished: {stats['added']} new contacts from {stats['pages']} pages")
 
 # Message Generation Page
 elif page == "Message Generation":
     st.header("Message Generation")
     
-    if "contacts" not in st.session_state:
+    if st.session_state.get("contact_source") not in ("store", "manual"):
         st.warning("Please add contacts first!")
     else:
         st.subheader("Create Greeting Template")
@@ -123,36 +266,34 @@ elif page == "Message Generation":
                                          "Dear {name}, Wishing you a joyous holiday season and a happy new year!")
         
         if st.button("Generate Multilingual Greetings"):
-            if "messages" not in st.session_state:
-                st.session_state.messages = []
+            # Regenerating replaces the previous messages instead of appending to them,
+            # reusing greetings for contacts that have not changed since the last run
+            if st.session_state.contact_source == "store":
+                store = ContactStore()
+                st.session_state.messages = build_messages_from_chunks(
+                    store.iter_chunks(),
+                    greeting_template,
+                    previous=st.session_state.get("messages")
+                )
+                store.close()
+            else:
+                st.session_state.messages = build_messages(
+                    st.session_state.contacts,
+                    greeting_template,
+                    previous=st.session_state.get("messages")
+                )
             
-            for _, contact in st.session_state.contacts.iterrows():
-                personalized_greeting = greeting_template.replace("{name}", contact["Name"])
-                
-                # Translate the greeting
-                if contact["Language"] != "en":
-                    translated_greeting = translate_text(personalized_greeting, contact["Language"])
-                else:
-                    translated_greeting = personalized_greeting
-                
-                message = {
-                    "name": contact["Name"],
-                    "email": contact["Email"],
-                    "phone": contact["Phone"],
-                    "whatsapp": contact["WhatsApp"],
-                    "language": contact["Language"],
-                    "country": contact["Country"],
-                    "greeting": translated_greeting
-                }
-                
-                st.session_state.messages.append(message)
+            # Saved once per generation for the scheduler and the trigger URL
+            with open("messages.json", "w") as f:
+                json.dump(message_records(st.session_state.messages), f)
             
-            st.success(f"Generated {len(st.session_state.messages)} personalized greetings!")
+            st.success(f"Generated {len(st.session_state.messages)} personalized greetings "
+                       f"({st.session_state.messages.attrs.get('rendered', 0)} new or changed)!")
             
             # Display sample messages
             st.subheader("Sample Messages")
-            for i, msg in enumerate(st.session_state.messages[:3]):
-                st.write(f"**{msg['name']} ({msg['language']}):** {msg['greeting']}")
+            for msg in st.session_state.messages.head(3).itertuples():
+                st.write(f"**{msg.name} ({msg.language}):** {msg.greeting}")
 
 # Send Messages Page
 elif page == "Send Messages":
@@ -163,11 +304,12 @@ elif page == "Send Messages":
     else:
         st.write(f"Ready to send {len(st.session_state.messages)} messages")
         
-        send_option = st.radio("Choose sending method", ["WhatsApp", "SMS", "Email"])
+        send_option = st.radio("Choose sending method", ["WhatsApp", "SMS", "Email", "All", "Fallback"],
+                               help="All sends on every channel at once; Fallback tries WhatsApp, then SMS, then Email")
         
-        # Add SMS service selection if SMS is chosen
+        # Add SMS service selection if SMS may be used
         sms_service = None
-        if send_option == "SMS":
+        if send_option in ("SMS", "All", "Fallback"):
             sms_service = st.selectbox("Select SMS service", ["TextBee", "Twilio", "TextBelt"])
             
             # Silently set Twilio credentials if Twilio is selected
@@ -177,73 +319,90 @@ elif page == "Send Messages":
                 st.session_state.twilio_token = TWILIO_AUTH_TOKEN
                 st.session_state.twilio_number = TWILIO_PHONE_NUMBER
                 st.info("Using configured Twilio credentials")
+            
+            messages_to_send = show_sms_plan(st.session_state.messages, sms_service.lower())
+        else:
+            messages_to_send = st.session_state.messages
         
         if st.button("Send Messages"):
-            sent_count = 0
-            
-            for message in st.session_state.messages:
-                try:
-                    if send_option == "WhatsApp" and message["whatsapp"]:
-                        success, response_text = send_whatsapp(message["whatsapp"], message["greeting"])
-                        st.write(f"WhatsApp API response: {success} - {response_text}")
-                        if success:
-                            sent_count += 1
-                    elif send_option == "SMS" and message["phone"]:
-                        if sms_service == "Twilio":
-                            success, response_text = send_sms(
-                                message["phone"], 
-                                message["greeting"],
-                                service="twilio",
-                                twilio_sid=st.session_state.twilio_sid,
-                                twilio_token=st.session_state.twilio_token,
-                                twilio_number=st.session_state.twilio_number
-                            )
-                        else:
-                            success, response_text = send_sms(
-                                message["phone"], 
-                                message["greeting"],
-                                service=sms_service.lower()
-                            )
-                        st.write(f"SMS API response: {success} - {response_text}")
-                        if success:
-                            sent_count += 1
-                    elif send_option == "Email" and message["email"]:
-                        success, response_text = send_email(
-                            message["email"], 
-                            "Seasonal Greetings", 
-                            message["greeting"]
-                        )
-                        st.write(f"Email API response: {success} - {response_text}")
-                        if success:
-                            sent_count += 1
-                except Exception as e:
-                    st.error(f"Error sending to {message['name']}: {str(e)}")
-                # Add a small delay to avoid rate limiting
-                time.sleep(1)
+            # Dead letters from this campaign are replayed through the same SMS service
+            st.session_state.sms_service = sms_service
             
-            if sent_count > 0:
-                st.success(f"Successfully sent {sent_count} out of {len(st.session_state.messages)} messages!")
-                st.balloons()  # Add a fun visual effect for successful sends
-            else:
-                st.error("No messages were sent successfully. Please check the errors above.")
-            
-            # Log successful messages
-            if sent_count > 0:
-                log_entry = {
-                    "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "method": send_option,
-                    "sent_count": sent_count,
-                    "total_count": len(st.session_state.messages)
-                }
-                
-                if "message_logs" not in st.session_state:
-                    st.session_state.message_logs = []
-                
-                st.session_state.message_logs.append(log_entry)
+            # The campaign is sent by a background worker; this page only watches it
+            st.session_state.send_job = get_job_manager().submit(
+                message_records(messages_to_send),
+                send_option.lower(),
+                make_dispatcher(sms_service)
+            )
+        
+        # Follow this session's job, or a job still running from before a refresh
+        campaign = st.session_state.get("send_job")
+        if campaign is None and get_job_manager().active():
+            campaign = get_job_manager().active()[0]["campaign"]
+        
+        if campaign:
+            progress = show_job_progress(campaign)
+            if progress and progress["state"] != "running" and st.session_state.get("announced_job") != campaign:
+                st.session_state.announced_job = campaign
+                if progress["sent"] > 0:
+                    st.success(f"Successfully sent {progress['sent']} out of {progress['total']} messages!")
+                    st.balloons()  # Add a fun visual effect for successful sends
+                elif progress["total"] == 0:
+                    st.info("Every message in this campaign has already been sent.")
+                else:
+                    st.error("No messages were sent successfully. Please check the errors above.")
+        else:
+            show_provider_metrics()
 
-            # Save messages to JSON file
-            with open("messages.json", "w") as f:
-                json.dump(st.session_state.messages, f)
+    # Messages parked while a provider was down can be resent in one go
+    queue = SendQueue()
+    dead_letters = queue.dead_letters()
+    queue.close()
+    if dead_letters:
+        st.subheader("Dead Letters")
+        dead_df = pd.DataFrame(dead_letters)
+        dead_df["parked_at"] = dead_df["parked_at"].map(datetime.fromtimestamp)
+        st.dataframe(dead_df, hide_index=True)
+        replay_service = None
+        if (dead_df["channel"].isin(["sms", "fallback"])).any():
+            services = ["TextBee", "Twilio", "TextBelt"]
+            last_service = st.session_state.get("sms_service") or "TextBelt"
+            replay_service = st.selectbox("SMS service to replay with", services,
+                                          index=services.index(last_service))
+        if st.button("Replay Dead Letters"):
+            replayed = get_job_manager().replay(dispatcher=make_dispatcher(replay_service))
+            if replayed:
+                st.session_state.send_job = replayed[0]
+            st.rerun()
+
+    # Opted-out and bouncing recipients are skipped before any provider call
+    with st.expander("Suppression List"):
+        suppress_text = st.text_area("Emails or phone numbers to stop sending to (one per line)")
+        suppress_reason = st.selectbox("Reason", [SUPPRESSED, BOUNCED])
+        if st.button("Add to Suppression List"):
+            added = get_recipient_index().add(
+                [line for line in suppress_text.splitlines() if line.strip()], suppress_reason
+            )
+            st.success(f"Added {added} recipients")
+        suppression_counts = get_recipient_index().counts()
+        if suppression_counts:
+            st.write(", ".join(f"{count} {reason}" for reason, count in suppression_counts.items()))
+
+    # Delivery history comes from the persistent delivery log, so it survives restarts
+    history = get_delivery_log().campaigns()
+    if history:
+        st.subheader("Delivery History")
+        history_df = pd.DataFrame(history)
+        history_df["started"] = history_df["started"].map(datetime.fromtimestamp)
+        history_df["finished"] = history_df["finished"].map(datetime.fromtimestamp)
+        st.dataframe(history_df, hide_index=True)
+        
+        selected_campaign = st.selectbox("Failure breakdown for campaign", history_df["campaign"])
+        failures = get_delivery_log().failures(selected_campaign)
+        if failures:
+            st.dataframe(pd.DataFrame(failures), hide_index=True)
+        else:
+            st.write("No failed, dead-lettered or skipped deliveries in this campaign.")
 
 # Schedule Page
 elif page == "Schedule":
@@ -253,23 +412,63 @@ elif page == "Schedule":
     # Check for trigger parameter in URL
     if st.query_params.get("trigger") == "1":
         try:
-            with open("messages.json", "r") as f:
-                st.session_state.messages = json.load(f)
+            # Submitted once per session; later reruns only refresh the progress
+            if st.session_state.get("trigger_job") is None:
+                with open("messages.json", "r") as f:
+                    messages = json.load(f)
+                st.session_state.messages = pd.DataFrame(messages)
+                # Send messages logic after loading
+                send_option = "WhatsApp"  # Or choose dynamically as per your logic
+                # Sent in the background; the queue remembers what earlier triggers already sent
+                st.session_state.trigger_job = get_job_manager().submit(messages, send_option.lower())
             st.success("Loaded messages from file")
-            # Send messages logic after loading
-            send_option = "WhatsApp"  # Or choose dynamically as per your logic
-            for message in st.session_state.messages:
-                if send_option == "WhatsApp" and message["whatsapp"]:
-                    success, response_text = send_whatsapp(message["whatsapp"], message["greeting"])
-                    st.write(f"WhatsApp API response: {success} - {response_text}")
+            show_job_progress(st.session_state.trigger_job)
         except Exception as e:
             st.error(f"Error loading messages: {e}")
 
     st.subheader("Configure Schedule")
     schedule_date = st.date_input("Select date to send messages")
     schedule_time = st.time_input("Select time to send messages")
+    schedule_method = st.selectbox("Sending method", ["WhatsApp", "SMS", "Email", "All", "Fallback"])
+    window_minutes = st.number_input("Spread sends over (minutes)", min_value=0, value=0,
+                                     help="Smooths provider load by pacing the campaign across a time window")
+    local_time = st.checkbox("Send at this time in each recipient's country")
 
     if st.button("Schedule Messages"):
-        scheduled_datetime = datetime.combine(schedule_date, schedule_time)
-        st.success(f"Messages scheduled to be sent on {scheduled_datetime}")
-        st.write("In a production environment, this would create a task on cron-job.org")
+        if "messages" not in st.session_state:
+            st.warning("Please generate messages first!")
+        else:
+            scheduled_datetime = datetime.combine(schedule_date, schedule_time)
+            campaign = schedule_campaign(
+                message_records(st.session_state.messages),
+                scheduled_datetime,
+                method=schedule_method.lower(),
+                window_seconds=window_minutes * 60,
+                local_time=local_time
+            )
+            st.success(f"Messages scheduled to be sent on {scheduled_datetime} (campaign {campaign})")
+            st.write("Scheduled messages are delivered by the scheduler service: `python scheduler.py --serve`")
+
+    queue = SendQueue()
+    campaigns = queue.campaigns()
+    queue.close()
+    if campaigns:
+        st.subheader("Scheduled Campaigns")
+        st.dataframe(pd.DataFrame([
+            {
+                "campaign": campaign,
+                # Campaigns sent straight away are queued due at 0
+                "starts": format_due(summary["first_due"]),
+                "ends": format_due(summary["last_due"]),
+                "pending": summary["pending"],
+                "sent": summary["sent"],
+                "failed": summary["failed"],
+                "skipped": summary["skipped"]
+            }
+            for campaign, summary in campaigns.items()
+        ]))
+
+# Refresh running job progress only after every section above has rendered
+if st.session_state.poll_jobs:
+    time.sleep(1)
+    st.rerun()
@@ -0,0 +1,50 @@
+"""
+Cold-start time of the headless scheduler entry point
+
+Run from the repository root:
+
+    python -m benchmarks.cold_start --runs 20
+
+Each run starts a fresh interpreter that imports scheduler (everything a
+cron-triggered send loads before doing any work) and compares it with an
+interpreter that imports nothing. Also lists any heavy modules that leaked
+into the import path.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = ["streamlit", "pandas", "requests", "twilio", "bs4"]
+
+
+def time_interpreter(code, runs):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True, cwd=os.getcwd())
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    baseline = time_interpreter("pass", args.runs)
+    scheduler = time_interpreter("import scheduler", args.runs)
+    loaded = subprocess.run(
+        [sys.executable, "-c", f"import sys, scheduler; print(*[m for m in {HEAVY_MODULES!r} if m in sys.modules])"],
+        check=True, capture_output=True, text=True,
+    ).stdout.split()
+
+    print(f"bare interpreter: {baseline:.0f} ms")
+    print(f"import scheduler: {scheduler:.0f} ms ({scheduler - baseline:.0f} ms over bare)")
+    print(f"heavy modules imported: {', '.join(loaded) or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Contact extraction benchmark over the saved HTML fixtures
+
+Run from the repository root:
+
+    python -m benchmarks.extraction_benchmark --sizes 1 4 16
+
+For every fixture it prints what the extractor finds, then times the
+extractor on documents built by repeating the fixture bodies up to each size
+in megabytes. Fixtures named no_contacts*.html hold dates, reference numbers
+and the like that must not be taken for contacts; the run exits non-zero if
+anything is found in them. Throughput should stay flat as the size grows. The original
+two-walk implementation is timed alongside for comparison.
+"""
+import argparse
+import re
+import sys
+import time
+from pathlib import Path
+
+from bs4 import BeautifulSoup
+
+import scraper
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+def legacy_extract(html):
+    """
+    The extraction scrape_contacts used before the single-pass engine
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    emails = []
+    email_pattern = r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}'
+    for text in soup.stripped_strings:
+        emails.extend(re.findall(email_pattern, text))
+    for link in soup.find_all('a'):
+        href = link.get('href', '')
+        if href.startswith('mailto:'):
+            emails.append(href[7:])
+    phones = []
+    phone_pattern = r'(\+\d{1,3}[-\.\s]??)?\(?\d{3}\)?[-\.\s]?\d{3}[-\.\s]?\d{4}'
+    for text in soup.stripped_strings:
+        phones.extend(re.findall(phone_pattern, text))
+    return emails, phones
+
+
+def scaled_document(bodies, megabytes):
+    """
+    Repeat fixture bodies until the document is about `megabytes` long
+    """
+    unit = "\n".join(bodies)
+    copies = max(1, int(megabytes * 1024 * 1024 / len(unit)))
+    return f"<html><body>{unit * copies}</body></html>"
+
+
+def time_call(fn, *args):
+    started = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 4, 16], help="document sizes in MB")
+    parser.add_argument("--skip-legacy", action="store_true", help="only time the current extractor")
+    args = parser.parse_args()
+
+    bodies = []
+    false_positives = []
+    for path in sorted(FIXTURES.glob("*.html")):
+        html = path.read_text(encoding="utf-8")
+        bodies.append(BeautifulSoup(html, "html.parser").body.decode_contents())
+        contacts, _ = scraper.parse_page(html)
+        legacy_emails, legacy_phones = legacy_extract(html)
+        print(f"{path.name}: {len(contacts)} contacts "
+              f"(legacy: {len(legacy_emails)} emails, {len(legacy_phones)} phone fragments)")
+        for row in contacts.itertuples():
+            print(f"    {row.Email or row.Phone}")
+            if path.name.startswith("no_contacts"):
+                false_positives.append(f"{path.name}: {row.Email or row.Phone}")
+
+    print()
+    print(f"{'size':>8} {'parse_page':>14} {'extract only':>14} {'legacy':>14}")
+    for megabytes in args.sizes:
+        html = scaled_document(bodies, megabytes)
+        size = len(html) / (1024 * 1024)
+        text = BeautifulSoup(html, scraper.HTML_PARSER).get_text("\n")
+        parse_seconds = time_call(scraper.parse_page, html)
+        extract_seconds = time_call(scraper.extract_contacts, text)
+        legacy = "-" if args.skip_legacy else f"{size / time_call(legacy_extract, html):.2f} MB/s"
+        print(f"{size:>6.1f}MB {size / parse_seconds:>9.2f} MB/s {size / extract_seconds:>9.2f} MB/s {legacy:>14}")
+
+    if false_positives:
+        print()
+        print("Taken for contacts but should not be:")
+        for entry in false_positives:
+            print(f"    {entry}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
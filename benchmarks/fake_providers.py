@@ -0,0 +1,142 @@
+"""
+Local stand-ins for the messaging and translation providers, for load tests
+and benchmarks
+
+One server answers every provider's API shape:
+
+- GreenAPI    POST .../sendMessage/...          {"idMessage": ...}
+- Twilio      POST /2010-04-01/Accounts/<sid>/Messages.json
+- TextBelt    POST /text                        {"success": true, "textId": ...}
+- Resend      POST /emails and /emails/batch
+- LibreTranslate POST /translate, GET /languages
+
+Each request sleeps `latency` seconds plus up to `jitter` more. A fraction
+`error_rate` of sends answer 500 and a fraction `rate_limit_rate` answer 429
+with a Retry-After of `retry_after` seconds. The server runs in several
+forked processes sharing one listening socket, so it does not become the
+bottleneck when many sending processes hit it at once.
+"""
+import json
+import multiprocessing
+import random
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+SECRETS = {
+    "TEXTBEE_API_KEY": "bench",
+    "RESEND_API_KEY": "bench",
+    "GREENAPI_INSTANCE_ID": "1000",
+    "GREENAPI_API_TOKEN": "bench",
+    "TWILIO_SID": "ACbench",
+    "TWILIO_AUTH_TOKEN": "bench",
+    "TWILIO_PHONE_NUMBER": "+15550000000",
+}
+
+
+def make_handler(latency, jitter=0.0, error_rate=0.0, rate_limit_rate=0.0, retry_after=1):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _reply(self, status, payload, headers=None):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _body(self):
+            raw = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if "json" in self.headers.get("Content-Type", ""):
+                return json.loads(raw or b"null")
+            return {key: values[0] for key, values in parse_qs(raw.decode()).items()}
+
+        def do_GET(self):
+            if self.path.startswith("/languages"):
+                self._reply(200, [{"code": code, "name": code} for code in ("en", "es", "fr", "de", "ja")])
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            body = self._body()
+            time.sleep(latency + random.uniform(0, jitter))
+            path = self.path.split("?")[0]
+
+            if path == "/translate":
+                q = body["q"]
+                target = body["target"]
+                translated = [f"[{target}] {text}" for text in q] if isinstance(q, list) else f"[{target}] {q}"
+                self._reply(200, {"translatedText": translated})
+                return
+
+            roll = random.random()
+            if roll < rate_limit_rate:
+                self._reply(429, {"message": "Too many requests"}, {"Retry-After": str(retry_after)})
+                return
+            if roll < rate_limit_rate + error_rate:
+                self._reply(500, {"message": "Injected failure", "status": 500})
+                return
+
+            if "/sendMessage/" in path:
+                self._reply(200, {"idMessage": f"fake-{uuid.uuid4().hex}"})
+            elif path.endswith("/Messages.json"):
+                sid = "SM" + uuid.uuid4().hex
+                self._reply(201, {"sid": sid, "status": "queued", "to": body.get("To"), "from": body.get("From"),
+                                  "body": body.get("Body")})
+            elif path == "/text":
+                self._reply(200, {"success": True, "textId": uuid.uuid4().hex, "quotaRemaining": 1000})
+            elif path == "/emails/batch":
+                self._reply(200, {"data": [{"id": uuid.uuid4().hex} for _ in body]})
+            elif path == "/emails":
+                self._reply(200, {"id": uuid.uuid4().hex})
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+class FakeProviderServer:
+    """
+    Pre-forked fake provider listening on a free localhost port
+    """
+
+    def __init__(self, latency=0.0, processes=4, jitter=0.0, error_rate=0.0, rate_limit_rate=0.0,
+                 retry_after=1):
+        handler = make_handler(latency, jitter, error_rate, rate_limit_rate, retry_after)
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        context = multiprocessing.get_context("fork")
+        self.processes = [context.Process(target=self.server.serve_forever, daemon=True) for _ in range(processes)]
+
+    def environ(self):
+        """
+        Environment variables that point every provider client at this server,
+        with dummy credentials
+        """
+        return {
+            **SECRETS,
+            "GREENAPI_URL": self.url,
+            "TEXTBELT_URL": f"{self.url}/text",
+            "RESEND_URL": self.url,
+            "TWILIO_API_URL": self.url,
+            "LIBRETRANSLATE_URL": self.url,
+            "TRANSLATION_BACKEND": "libretranslate",
+        }
+
+    def __enter__(self):
+        for process in self.processes:
+            process.start()
+        return self
+
+    def __exit__(self, *exc):
+        for process in self.processes:
+            process.terminate()
+        self.server.server_close()
@@ -0,0 +1,261 @@
+"""
+End-to-end load test against local provider stand-ins
+
+Run from the repository root:
+
+    python -m benchmarks.load_test --contacts 1000 10000 100000 --latency 0.02 --error-rate 0.01
+
+Three scenarios run at each contact count, each in a fresh process so peak
+RSS is measured per scenario:
+
+- generate   build_messages over synthetic contacts, translating through
+             the fake LibreTranslate
+- send       Dispatcher.run over the generated messages via the
+             messaging.py senders
+- scheduled  send_scheduled_messages end to end, from messages.json through
+             the send queue; with injected errors its time includes the
+             queue's retry backoff
+
+Every result is appended to benchmarks/results/load_test.jsonl with the git
+revision, and compared with the last stored run of the same scenario and
+settings. --check exits non-zero when throughput fell by more than
+--tolerance.
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from benchmarks.fake_providers import SECRETS, FakeProviderServer
+
+SCENARIOS = ["generate", "send", "scheduled"]
+RESULTS_PATH = Path(__file__).parent / "results" / "load_test.jsonl"
+LANGUAGES = ["en", "es", "fr", "de", "ja"]
+TEMPLATE = "Season's greetings, {name}! Wishing you a wonderful year ahead."
+
+# Far above what the machine can reach, so the providers' latency and the
+# code under test set the pace rather than the rate limiter
+LIMITS = {
+    provider: {"rate": 1_000_000.0, "burst": 1_000_000, "concurrency": 64}
+    for provider in ["greenapi", "twilio", "textbelt", "textbee", "resend"]
+}
+
+
+def make_contacts(count):
+    import pandas as pd
+
+    return pd.DataFrame({
+        "Name": [f"Contact {i}" for i in range(count)],
+        "Email": [f"contact{i}@example.com" for i in range(count)],
+        "Phone": [f"+1555{i:07d}" for i in range(count)],
+        "WhatsApp": [f"+1556{i:07d}" for i in range(count)],
+        "Language": [LANGUAGES[i % len(LANGUAGES)] for i in range(count)],
+        "Country": ["US"] * count,
+    })
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def latency_summary():
+    """
+    Per-provider send latency quantiles in milliseconds from the metrics registry
+    """
+    from metrics import registry
+
+    summary = {}
+    for row in registry.snapshot():
+        if row["operation"] != "send":
+            continue
+        summary[row["provider"]] = {
+            "requests": row["requests"],
+            "errors": row["error"] + row["rate_limited"],
+            "retries": row["retries"],
+            **{q: round(row[q] * 1000, 1) for q in ("p50", "p95", "p99")},
+        }
+    return summary
+
+
+def run_scenario(scenario, count, environ, method, sms_service):
+    """
+    Run one scenario in the current (fresh) process and return its result
+    """
+    os.environ.update(environ)
+    os.chdir(tempfile.mkdtemp(prefix="load-test-"))
+
+    from generator import build_messages, message_records
+
+    contacts = make_contacts(count)
+    started = time.perf_counter()
+    messages = build_messages(contacts, TEMPLATE)
+    generated = time.perf_counter() - started
+    records = message_records(messages)
+    result = {"messages": len(records)}
+
+    if scenario == "generate":
+        result.update(seconds=generated, per_second=len(records) / generated)
+        return result
+
+    if scenario == "send":
+        from dispatcher import Dispatcher, build_tasks
+
+        sms_kwargs = {
+            "twilio_sid": SECRETS["TWILIO_SID"],
+            "twilio_token": SECRETS["TWILIO_AUTH_TOKEN"],
+            "twilio_number": SECRETS["TWILIO_PHONE_NUMBER"],
+        }
+        dispatcher = Dispatcher(limits=LIMITS, sms_service=sms_service, sms_kwargs=sms_kwargs)
+        sent = failed = 0
+        started = time.perf_counter()
+        for _, success, _ in dispatcher.run(build_tasks(records, method)):
+            if success:
+                sent += 1
+            else:
+                failed += 1
+        elapsed = time.perf_counter() - started
+    else:
+        from scheduler import send_scheduled_messages
+        from send_queue import DEAD_LETTER, FAILED, SENT, SendQueue
+
+        with open("messages.json", "w") as f:
+            json.dump(records, f)
+        started = time.perf_counter()
+        # Keep the per-failure log lines out of the report
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            send_scheduled_messages(method, sms_service=sms_service, limits=LIMITS)
+        elapsed = time.perf_counter() - started
+        # Final state of each queued message, not attempts, so retries count once
+        queue = SendQueue()
+        counts = queue.counts()
+        queue.close()
+        sent = counts[SENT]
+        failed = counts[FAILED] + counts[DEAD_LETTER]
+
+    result.update(
+        seconds=elapsed,
+        sent=sent,
+        failed=failed,
+        per_second=(sent + failed) / elapsed,
+        latency_ms=latency_summary(),
+    )
+    return result
+
+
+def _child(scenario, count, environ, method, sms_service, results):
+    # Importing inside a spawned process keeps each scenario's peak RSS separate
+    result = run_scenario(scenario, count, environ, method, sms_service)
+    result["peak_rss_mb"] = round(peak_rss_mb(), 1)
+    results.put(result)
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def load_results(path=RESULTS_PATH):
+    if not path.exists():
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def previous_result(history, record):
+    """
+    Most recent stored result with the same scenario and settings
+    """
+    for earlier in reversed(history):
+        if earlier["scenario"] == record["scenario"] and earlier["settings"] == record["settings"]:
+            return earlier
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--contacts", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--method", default="all", choices=["all", "fallback", "whatsapp", "sms", "email"])
+    parser.add_argument("--sms-service", default="textbelt", choices=["textbelt", "twilio"])
+    parser.add_argument("--latency", type=float, default=0.02, help="fake provider latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.01, help="extra random latency, up to this many seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of sends answered with a 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of sends answered with a 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds on injected 429s")
+    parser.add_argument("--output", type=Path, default=RESULTS_PATH)
+    parser.add_argument("--check", action="store_true", help="exit non-zero on a throughput regression")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed throughput drop for --check")
+    args = parser.parse_args()
+
+    history = load_results(args.output)
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    revision = git_revision()
+    regressions = []
+    context = multiprocessing.get_context("spawn")
+
+    with FakeProviderServer(args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                            rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after) as server:
+        for count in args.contacts:
+            for scenario in args.scenarios:
+                results = context.Queue()
+                process = context.Process(
+                    target=_child,
+                    args=(scenario, count, server.environ(), args.method, args.sms_service, results),
+                )
+                process.start()
+                result = results.get()
+                process.join()
+
+                record = {
+                    "timestamp": datetime.now().isoformat(timespec="seconds"),
+                    "revision": revision,
+                    "scenario": scenario,
+                    "settings": {
+                        "contacts": count,
+                        "method": args.method,
+                        "sms_service": args.sms_service,
+                        "latency": args.latency,
+                        "jitter": args.jitter,
+                        "error_rate": args.error_rate,
+                        "rate_limit_rate": args.rate_limit_rate,
+                    },
+                    **result,
+                }
+                with open(args.output, "a") as f:
+                    f.write(json.dumps(record) + "\n")
+
+                line = (f"{scenario:>9} {count:>7} contacts: {result['per_second']:,.0f} msg/s, "
+                        f"{result['seconds']:.2f}s, peak RSS {result['peak_rss_mb']} MB")
+                for provider, stats in result.get("latency_ms", {}).items():
+                    line += f"\n{'':>19}{provider}: p50 {stats['p50']} ms, p95 {stats['p95']} ms, p99 {stats['p99']} ms"
+                earlier = previous_result(history, record)
+                if earlier:
+                    change = result["per_second"] / earlier["per_second"] - 1
+                    line += f"\n{'':>19}{change:+.0%} msg/s vs {earlier['revision']} ({earlier['timestamp']})"
+                    if change < -args.tolerance:
+                        regressions.append(f"{scenario} at {count} contacts: {change:+.0%}")
+                print(line, flush=True)
+
+    if regressions:
+        print("Throughput regressions:\n  " + "\n  ".join(regressions))
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
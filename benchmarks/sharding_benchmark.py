@@ -0,0 +1,66 @@
+"""
+Multi-process send throughput against a local fake provider
+
+Run from the repository root:
+
+    python -m benchmarks.sharding_benchmark --messages 5000 --workers 1 2 4 8
+
+Each run queues the same WhatsApp campaign into a fresh send queue and
+drains it with scheduler.send_sharded. Provider limits are set far above
+what the machine can reach, so throughput should grow with the worker count
+until the machine itself becomes the bottleneck.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.fake_providers import FakeProviderServer
+
+# Generous enough that only the machine limits throughput; each worker gets 1/N
+LIMITS = {"greenapi": {"rate": 1_000_000.0, "burst": 1_000_000, "concurrency": 256}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--latency", type=float, default=0.005, help="fake provider latency in seconds")
+    args = parser.parse_args()
+
+    repo = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp, FakeProviderServer(args.latency) as server:
+        # Endpoints and credentials come from the environment; spawned
+        # workers inherit it
+        os.environ.update(server.environ())
+        os.chdir(tmp)
+        sys.path.insert(0, repo)
+        os.environ["PYTHONPATH"] = os.pathsep.join(filter(None, [repo, os.environ.get("PYTHONPATH")]))
+
+        from scheduler import send_sharded
+        from send_queue import SendQueue
+
+        messages = [
+            {"name": f"Contact {i}", "whatsapp": f"+1555{i:07d}", "greeting": "Hello!"}
+            for i in range(args.messages)
+        ]
+        baseline = None
+        for workers in args.workers:
+            queue = SendQueue(os.path.join(tmp, f"queue-{workers}.db"))
+            campaign = queue.enqueue(messages, "whatsapp")
+            started = time.perf_counter()
+            sent = send_sharded(queue, campaign, workers, limits=LIMITS)
+            elapsed = time.perf_counter() - started
+            counts = queue.counts(campaign)
+            queue.close()
+
+            rate = sent / elapsed
+            baseline = baseline or rate / workers
+            print(f"{workers} workers: {sent} sent in {elapsed:.2f}s, {rate:,.0f} msg/s, "
+                  f"{rate / (baseline * workers):.0%} of linear, counts {counts}")
+        os.chdir(repo)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Translation throughput benchmark against a local LibreTranslate stand-in
+
+Run from the repository root:
+
+    python -m benchmarks.translation_benchmark --texts 10000 --languages fr es de --latency 0.05
+
+The stub answers /translate with array or string `q`, sleeping `--latency`
+seconds per request, so the numbers reflect request count and batching rather
+than a real translation model.
+"""
+import argparse
+import json
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import translator
+
+
+def start_stub_server(latency=0.0):
+    """
+    Start a LibreTranslate-compatible stub on a free localhost port
+
+    Returns the server and a dict counting the requests it has served.
+    """
+    stats = {"requests": 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            with lock:
+                stats["requests"] += 1
+            time.sleep(latency)
+            q = body["q"]
+            target = body["target"]
+            if isinstance(q, list):
+                translated = [f"[{target}] {text}" for text in q]
+            else:
+                translated = f"[{target}] {q}"
+            payload = json.dumps({"translatedText": translated}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stats
+
+
+def run(texts, languages, batch_size, latency):
+    server, stats = start_stub_server(latency)
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    with tempfile.TemporaryDirectory() as tmp:
+        translator.set_cache(translator.TranslationCache(f"{tmp}/cache.db"))
+        translator.set_backend(translator.LibreTranslateBackend(url=url, batch_size=batch_size))
+        corpus = [f"Greeting number {i}" for i in range(texts)]
+
+        started = time.perf_counter()
+        for lang in languages:
+            translator.translate_batch(corpus, lang)
+        cold = time.perf_counter() - started
+        cold_requests = stats["requests"]
+
+        started = time.perf_counter()
+        for lang in languages:
+            translator.translate_batch(corpus, lang)
+        warm = time.perf_counter() - started
+    server.shutdown()
+
+    total = texts * len(languages)
+    print(f"batch size {batch_size}: {total} texts, {cold_requests} requests, "
+          f"{total / cold:,.0f} texts/s cold, {total / warm:,.0f} texts/s from cache, "
+          f"{stats['requests'] - cold_requests} requests on re-run")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--texts", type=int, default=2000)
+    parser.add_argument("--languages", nargs="+", default=["fr", "es", "de"])
+    parser.add_argument("--latency", type=float, default=0.02, help="stub latency per request in seconds")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, translator.TRANSLATION_BATCH_SIZE])
+    args = parser.parse_args()
+    for batch_size in args.batch_sizes:
+        run(args.texts, args.languages, batch_size, args.latency)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import os
+import threading
+from pathlib import Path
+
+# Streamlit's secrets files; the project's own file wins over the user-wide one
+SECRETS_PATHS = [Path(".streamlit") / "secrets.toml", Path.home() / ".streamlit" / "secrets.toml"]
+
+_secrets = None
+_lock = threading.Lock()
+
+
+def _read_toml(path):
+    try:
+        import tomllib
+    except ImportError:
+        # Python < 3.11; the toml package comes with Streamlit
+        import toml
+
+        with open(path) as f:
+            return toml.load(f)
+    with open(path, "rb") as f:
+        return tomllib.load(f)
+
+
+def _load():
+    global _secrets
+    with _lock:
+        if _secrets is None:
+            from dotenv import load_dotenv
+
+            load_dotenv()
+            secrets = {}
+            for path in reversed(SECRETS_PATHS):
+                if path.is_file():
+                    secrets.update(_read_toml(path))
+            _secrets = secrets
+        return _secrets
+
+
+def get_setting(name, default=None):
+    """
+    Look up a setting in the environment (including a .env file), then in
+    Streamlit's secrets.toml, without importing Streamlit
+
+    Files are read once per process, on first use.
+    """
+    secrets = _load()
+    value = os.environ.get(name)
+    if value is not None:
+        return value
+    return secrets.get(name, default)
+
+
+def reload():
+    """
+    Forget the loaded files so the next lookup reads them again
+    """
+    global _secrets
+    with _lock:
+        _secrets = None
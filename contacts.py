@@ -0,0 +1,172 @@
+import re
+import sqlite3
+import threading
+
+import pandas as pd
+
+CONTACTS_PATH = "contacts.db"
+CHUNK_SIZE = 50000
+
+CONTACT_COLUMNS = ["Name", "Email", "Phone", "WhatsApp", "Language", "Country"]
+# Everything is read as text so phone numbers keep their leading + and zeros
+CSV_DTYPES = {column: "string" for column in CONTACT_COLUMNS}
+
+EMAIL_PATTERN = r"^[a-z0-9._%+-]+@[a-z0-9.-]+\.[a-z]{2,}$"
+# E.164 allows at most 15 digits; anything under 8 is not a full international number
+PHONE_PATTERN = r"^\+[1-9]\d{7,14}$"
+PHONE_JUNK = re.compile(r"[\s\-\.\(\)/]")
+
+
+def normalize_phones(phones):
+    """
+    Normalize a Series of phone numbers to E.164, blanking invalid ones
+
+    Separators are removed, a leading 00 becomes +, and bare digit strings
+    are assumed to already include their country code.
+    """
+    phones = phones.fillna("").astype(str).str.strip()
+    phones = phones.str.replace(PHONE_JUNK, "", regex=True)
+    phones = phones.str.replace(r"^00", "+", regex=True)
+    phones = phones.where(phones.str.startswith("+") | (phones == ""), "+" + phones)
+    return phones.where(phones.str.match(PHONE_PATTERN), "")
+
+
+def normalize_emails(emails):
+    """
+    Lowercase and trim a Series of email addresses, blanking invalid ones
+    """
+    emails = emails.fillna("").astype(str).str.strip().str.lower()
+    emails = emails.str.replace(r"^mailto:", "", regex=True)
+    return emails.where(emails.str.match(EMAIL_PATTERN), "")
+
+
+def normalize_contacts(chunk):
+    """
+    Normalize a chunk of contacts and drop rows with no usable address
+    """
+    chunk = chunk.reindex(columns=CONTACT_COLUMNS)
+    chunk["Name"] = chunk["Name"].fillna("").astype(str).str.strip()
+    chunk["Email"] = normalize_emails(chunk["Email"])
+    chunk["Phone"] = normalize_phones(chunk["Phone"])
+    chunk["WhatsApp"] = normalize_phones(chunk["WhatsApp"])
+    chunk["Language"] = chunk["Language"].fillna("").astype(str).str.strip().str.lower()
+    chunk["Language"] = chunk["Language"].where(chunk["Language"] != "", "en")
+    chunk["Country"] = chunk["Country"].fillna("").astype(str).str.strip()
+
+    has_address = (chunk["Email"] != "") | (chunk["Phone"] != "") | (chunk["WhatsApp"] != "")
+    return chunk[has_address]
+
+
+def read_contacts_csv(source, chunksize=CHUNK_SIZE):
+    """
+    Yield raw contact chunks from a CSV path or file object, every column as text
+    """
+    reader = pd.read_csv(
+        source,
+        dtype=CSV_DTYPES,
+        usecols=lambda column: column in CONTACT_COLUMNS,
+        chunksize=chunksize,
+        keep_default_na=False,
+    )
+    yield from reader
+
+
+class ContactStore:
+    """
+    Deduplicated contact list kept in SQLite
+
+    Contacts are unique on (Email, Phone, WhatsApp). CSVs are ingested in
+    chunks, so memory use depends on the chunk size rather than the file size.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or CONTACTS_PATH
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS contacts ("
+            "id INTEGER PRIMARY KEY, Name TEXT NOT NULL, Email TEXT NOT NULL, Phone TEXT NOT NULL, "
+            "WhatsApp TEXT NOT NULL, Language TEXT NOT NULL, Country TEXT NOT NULL, "
+            "UNIQUE (Email, Phone, WhatsApp))"
+        )
+        self._conn.commit()
+
+    def add(self, contacts, normalized=False):
+        """
+        Add a DataFrame of contacts, skipping duplicates and ones already stored
+
+        Returns the number of new contacts.
+        """
+        if not normalized:
+            contacts = normalize_contacts(contacts)
+        contacts = contacts.drop_duplicates(subset=["Email", "Phone", "WhatsApp"])
+        rows = contacts[CONTACT_COLUMNS].itertuples(index=False, name=None)
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO contacts (Name, Email, Phone, WhatsApp, Language, Country) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+            return self._conn.total_changes - before
+
+    def ingest_csv(self, source, chunksize=CHUNK_SIZE, replace=False):
+        """
+        Stream a CSV into the store chunk by chunk
+
+        Returns counts of rows read, contacts added, and rows dropped as
+        invalid or duplicate.
+        """
+        if replace:
+            self.clear()
+        stats = {"rows": 0, "added": 0, "invalid": 0, "duplicates": 0}
+        for chunk in read_contacts_csv(source, chunksize):
+            valid = normalize_contacts(chunk)
+            added = self.add(valid, normalized=True)
+            stats["rows"] += len(chunk)
+            stats["added"] += added
+            stats["invalid"] += len(chunk) - len(valid)
+            stats["duplicates"] += len(valid) - added
+        return stats
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM contacts").fetchone()[0]
+
+    def page(self, page_number, page_size=50):
+        """
+        One page of contacts for previews, in insertion order
+        """
+        with self._lock:
+            return pd.read_sql_query(
+                f"SELECT {', '.join(CONTACT_COLUMNS)} FROM contacts ORDER BY id LIMIT ? OFFSET ?",
+                self._conn,
+                params=(page_size, page_number * page_size),
+            )
+
+    def iter_chunks(self, chunksize=CHUNK_SIZE):
+        """
+        Yield all contacts as DataFrames of at most `chunksize` rows
+        """
+        last_id = 0
+        while True:
+            with self._lock:
+                chunk = pd.read_sql_query(
+                    f"SELECT id, {', '.join(CONTACT_COLUMNS)} FROM contacts WHERE id > ? ORDER BY id LIMIT ?",
+                    self._conn,
+                    params=(last_id, chunksize),
+                )
+            if chunk.empty:
+                return
+            last_id = int(chunk["id"].iloc[-1])
+            yield chunk.drop(columns="id")
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM contacts")
+            self._conn.commit()
+
+    def close(self):
+        self._conn.close()
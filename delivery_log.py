@@ -0,0 +1,176 @@
+import atexit
+import sqlite3
+import threading
+import time
+
+DELIVERY_LOG_PATH = "delivery_log.db"
+# Buffered records are written when this many are waiting...
+FLUSH_SIZE = 500
+# ...or after this many seconds, whichever comes first
+FLUSH_SECONDS = 2.0
+# Records older than this are dropped when the log is opened
+RETENTION_DAYS = 90
+
+SENT = "sent"
+FAILED = "failed"
+# An attempt that failed but will be retried; the message's outcome comes later
+RETRYING = "retrying"
+DEAD_LETTER = "dead_letter"
+SKIPPED = "skipped"
+# Statuses that end a message without delivering it
+UNDELIVERED = (FAILED, DEAD_LETTER, SKIPPED)
+
+COLUMNS = ["ts", "campaign", "recipient", "channel", "provider", "provider_message_id", "status",
+           "latency_ms", "error"]
+
+
+class DeliveryLog:
+    """
+    Append-only per-message delivery log in SQLite
+
+    `record` only appends to an in-memory buffer; a background thread writes
+    the buffer in one transaction every FLUSH_SECONDS or FLUSH_SIZE records.
+    The database runs in WAL mode with synchronous=NORMAL, so there is no
+    fsync per message, and several processes can log to the same file.
+    Records older than `retention_days` are pruned when the log is opened.
+    """
+
+    def __init__(self, path=None, flush_size=FLUSH_SIZE, flush_seconds=FLUSH_SECONDS,
+                 retention_days=RETENTION_DAYS):
+        self.path = path or DELIVERY_LOG_PATH
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS deliveries ("
+            "id INTEGER PRIMARY KEY, ts REAL NOT NULL, campaign TEXT, recipient TEXT, channel TEXT, "
+            "provider TEXT, provider_message_id TEXT, status TEXT NOT NULL, latency_ms REAL, error TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS deliveries_campaign ON deliveries (campaign, ts)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS deliveries_status ON deliveries (status, channel, provider)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS deliveries_ts ON deliveries (ts)")
+        if retention_days:
+            self._conn.execute("DELETE FROM deliveries WHERE ts < ?", (time.time() - retention_days * 86400,))
+        self._conn.commit()
+        self._flusher = threading.Thread(target=self._flush_loop, name="delivery-log-flush", daemon=True)
+        self._flusher.start()
+
+    def record(self, campaign, recipient, channel, provider, status, provider_message_id=None,
+               latency_ms=None, error=None):
+        """
+        Buffer one delivery attempt; it reaches the database on the next flush
+        """
+        row = (time.time(), campaign, recipient, channel, provider, provider_message_id, status,
+               latency_ms, error)
+        with self._lock:
+            self._buffer.append(row)
+            full = len(self._buffer) >= self.flush_size
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        """
+        Write every buffered record in a single transaction
+        """
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+        if not rows:
+            return 0
+        with self._db_lock:
+            with self._conn:
+                self._conn.executemany(
+                    f"INSERT INTO deliveries ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                    rows,
+                )
+        return len(rows)
+
+    def _flush_loop(self):
+        while not self._closed:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"Delivery log flush failed: {e}")
+
+    def _query(self, sql, params=()):
+        self.flush()
+        with self._db_lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def campaigns(self, limit=50):
+        """
+        Most recent campaigns with their time span and sent, failed,
+        dead-lettered and skipped counts
+        """
+        rows = self._query(
+            "SELECT campaign, MIN(ts), MAX(ts), "
+            "SUM(status = ?), SUM(status = ?), SUM(status = ?), SUM(status = ?), COUNT(DISTINCT recipient) "
+            "FROM deliveries GROUP BY campaign ORDER BY MAX(ts) DESC LIMIT ?",
+            (SENT, FAILED, DEAD_LETTER, SKIPPED, limit),
+        )
+        return [
+            {"campaign": campaign, "started": started, "finished": finished, "sent": sent,
+             "failed": failed, "dead_letter": dead_letter, "skipped": skipped, "recipients": recipients}
+            for campaign, started, finished, sent, failed, dead_letter, skipped, recipients in rows
+        ]
+
+    def failures(self, campaign=None, limit=50):
+        """
+        Failed, dead-lettered and skipped messages grouped by status, channel,
+        provider and error, most common first
+        """
+        query = ("SELECT status, channel, provider, error, COUNT(*) FROM deliveries "
+                 f"WHERE status IN ({', '.join('?' * len(UNDELIVERED))})")
+        params = list(UNDELIVERED)
+        if campaign:
+            query += " AND campaign = ?"
+            params.append(campaign)
+        query += " GROUP BY status, channel, provider, error ORDER BY COUNT(*) DESC LIMIT ?"
+        params.append(limit)
+        return [
+            {"status": status, "channel": channel, "provider": provider, "error": error, "count": count}
+            for status, channel, provider, error, count in self._query(query, params)
+        ]
+
+    def deliveries(self, campaign, limit=1000):
+        """
+        A campaign's delivery attempts, newest first
+        """
+        rows = self._query(
+            f"SELECT {', '.join(COLUMNS)} FROM deliveries WHERE campaign = ? ORDER BY ts DESC LIMIT ?",
+            (campaign, limit),
+        )
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self._flusher.join()
+        self.flush()
+        self._conn.close()
+
+
+_log = None
+_log_lock = threading.Lock()
+
+
+def get_delivery_log():
+    """
+    Return the process-wide delivery log, flushed and closed at exit
+    """
+    global _log
+    with _log_lock:
+        if _log is None:
+            _log = DeliveryLog()
+            atexit.register(_log.close)
+        return _log
@@ -0,0 +1,502 @@
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from metrics import registry
+from messaging import (
+    send_whatsapp, send_sms, send_email, send_email_batch, RateLimited, ProviderUnavailable, RESEND_BATCH_SIZE
+)
+
+# Default per-provider limits: sustained sends per second, burst size and the
+# maximum number of requests in flight at once. Override any of these by
+# passing `limits` to Dispatcher.
+PROVIDER_LIMITS = {
+    "greenapi": {"rate": 1.0, "burst": 1, "concurrency": 1},
+    "twilio": {"rate": 1.0, "burst": 1, "concurrency": 1},
+    "textbelt": {"rate": 1.0, "burst": 1, "concurrency": 1},
+    "textbee": {"rate": 1.0, "burst": 1, "concurrency": 1},
+    "resend": {"rate": 2.0, "burst": 2, "concurrency": 2},
+}
+
+# Message field holding the address for each channel
+CHANNEL_FIELDS = {
+    "whatsapp": "whatsapp",
+    "sms": "phone",
+    "email": "email",
+}
+
+# method="fallback" sends each contact on the first channel it can be reached
+# on and moves down this list only when a send fails
+FALLBACK = "fallback"
+FALLBACK_ORDER = ["whatsapp", "sms", "email"]
+
+EMAIL_SUBJECT = "Seasonal Greetings"
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled at `rate` tokens per second
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until a token is available and take it
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """
+        Stop handing out tokens for `seconds`, e.g. after a 429 response
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+            self._updated = self._paused_until
+
+
+# Circuit breaker settings: calls in the rolling window, the fewest calls
+# before it may trip, the share of failed or slow calls that trips it, what
+# counts as slow, and how long it stays open before a half-open probe
+BREAKER_WINDOW = 20
+BREAKER_MIN_CALLS = 5
+BREAKER_FAILURE_RATE = 0.5
+BREAKER_SLOW_SECONDS = 10.0
+BREAKER_COOLDOWN = 30.0
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(Exception):
+    """
+    Raised instead of calling a provider whose circuit breaker is open
+    """
+    def __init__(self, provider, retry_in):
+        super().__init__(f"{provider} circuit open, next probe in {retry_in:.0f}s")
+        self.provider = provider
+
+
+class CircuitBreaker:
+    """
+    Thread-safe circuit breaker for one provider
+
+    Trips open when at least `failure_rate` of the last `window` calls
+    failed (the provider was unreachable, timed out or answered 5xx) or took
+    longer than `slow_seconds`. While open every call fails fast. After
+    `cooldown` seconds one half-open probe is let through: success closes
+    the breaker, failure opens it again.
+    """
+
+    def __init__(self, provider, window=BREAKER_WINDOW, min_calls=BREAKER_MIN_CALLS,
+                 failure_rate=BREAKER_FAILURE_RATE, slow_seconds=BREAKER_SLOW_SECONDS, cooldown=BREAKER_COOLDOWN):
+        self.provider = provider
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_seconds = slow_seconds
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self._outcomes = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Whether a call may go ahead; raises CircuitOpen if not
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            wait = self._opened_at + self.cooldown - time.monotonic()
+            if self.state == OPEN and wait <= 0:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            raise CircuitOpen(self.provider, max(0.0, wait))
+
+    def record(self, ok, seconds):
+        """
+        Record a call's outcome: `ok` is False when the provider itself failed
+        """
+        healthy = ok and seconds <= self.slow_seconds
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probing = False
+                if healthy:
+                    self.state = CLOSED
+                    self._outcomes.clear()
+                else:
+                    self._open()
+                return
+            self._outcomes.append(healthy)
+            failures = self._outcomes.count(False)
+            if len(self._outcomes) >= self.min_calls and failures >= self.failure_rate * len(self._outcomes):
+                self._open()
+
+    def _open(self):
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_for(provider):
+    """
+    Process-wide circuit breaker for a provider, shared by every Dispatcher
+    so one job's view of an outage protects the others
+    """
+    with _breakers_lock:
+        if provider not in _breakers:
+            _breakers[provider] = CircuitBreaker(provider)
+        return _breakers[provider]
+
+
+def breaker_states():
+    """
+    Current state of every provider's circuit breaker in this process
+    """
+    with _breakers_lock:
+        return {provider: breaker.state for provider, breaker in _breakers.items()}
+
+
+class ProviderGate:
+    """
+    Rate limit, concurrency cap and circuit breaker for a single provider
+    """
+
+    def __init__(self, rate, burst, concurrency, breaker):
+        self.breaker = breaker
+        self.bucket = TokenBucket(rate, burst)
+        self.slots = threading.BoundedSemaphore(max(1, concurrency))
+        self.concurrency = max(1, concurrency)
+
+
+def split_limit(value, worker):
+    """
+    This worker's part of an integer cap split between `count` workers,
+    given as (index, count): the remainder goes to the lowest indexes, and
+    no worker gets less than one
+    """
+    index, count = worker
+    return max(1, value // count + (1 if index < value % count else 0))
+
+
+def provider_for(channel, sms_service="textbelt"):
+    """
+    Name of the provider that handles a channel
+    """
+    if channel == "whatsapp":
+        return "greenapi"
+    if channel == "email":
+        return "resend"
+    return sms_service.lower()
+
+
+def method_channels(method):
+    """
+    Channels a send method covers: "all" fans out to every channel
+    """
+    return list(CHANNEL_FIELDS) if method == "all" else [method]
+
+
+def recipient_for(message, channel):
+    """
+    Address a message goes to on a channel, or None if it has none
+
+    For the fallback channel this is the first reachable channel's address.
+    """
+    if channel == FALLBACK:
+        return next((message[CHANNEL_FIELDS[c]] for c in FALLBACK_ORDER if message.get(CHANNEL_FIELDS[c])), None)
+    return message.get(CHANNEL_FIELDS[channel]) or None
+
+
+def build_tasks(messages, method="all"):
+    """
+    Expand messages into one send task per (message, channel) pair
+
+    `method` is a single channel ("whatsapp", "sms", "email"), "all" to
+    send on every channel at once, or "fallback" for one task per message
+    that tries its channels in priority order. Messages without an address
+    for a channel are skipped for it.
+    """
+    return [
+        {"message": message, "channel": channel}
+        for message in messages
+        for channel in method_channels(method)
+        if recipient_for(message, channel)
+    ]
+
+
+class Dispatcher:
+    """
+    Concurrent send engine shared by the Streamlit app and scheduler.py
+
+    Each provider gets its own token bucket and concurrency cap, so a campaign
+    runs as fast as each provider allows. 429 responses pause the provider for
+    its Retry-After time (or an exponential backoff) and the send is retried.
+    When several worker processes send at once, `worker` is this process's
+    (index, count): each takes 1/count of every provider's rate, and the
+    burst and concurrency caps are split between them with the remainder
+    going to the lowest indexes. Every worker keeps at least one slot so it
+    can reach its own recipients, so a cap smaller than the number of
+    workers is exceeded by that difference. Fallback tasks try
+    the channels in `fallback_order` until one succeeds. Providers that keep
+    failing trip a process-wide circuit breaker, after which their sends
+    fail fast and come back flagged "unavailable" and not to be retried
+    until a probe succeeds.
+    """
+
+    def __init__(self, limits=None, sms_service="textbelt", sms_kwargs=None,
+                 subject=EMAIL_SUBJECT, max_retries=3, backoff=1.0, batch_email=True, worker=None,
+                 fallback_order=None):
+        self.limits = {name: dict(values) for name, values in PROVIDER_LIMITS.items()}
+        for name, values in (limits or {}).items():
+            self.limits.setdefault(name, dict(PROVIDER_LIMITS["textbelt"])).update(values)
+        self.sms_service = sms_service
+        self.sms_kwargs = sms_kwargs or {}
+        self.subject = subject
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.batch_email = batch_email
+        self.worker = worker or (0, 1)
+        self.fallback_order = list(fallback_order or FALLBACK_ORDER)
+        self._gates = {}
+        self._gates_lock = threading.Lock()
+
+    def gate(self, provider):
+        with self._gates_lock:
+            if provider not in self._gates:
+                limit = self.limits.get(provider, PROVIDER_LIMITS["textbelt"])
+                self._gates[provider] = ProviderGate(
+                    limit["rate"] / self.worker[1],
+                    split_limit(limit["burst"], self.worker),
+                    split_limit(limit["concurrency"], self.worker),
+                    breaker_for(provider),
+                )
+            return self._gates[provider]
+
+    def _call_provider(self, task):
+        message = task["message"]
+        channel = task["channel"]
+        if channel == "whatsapp":
+            return send_whatsapp(message["whatsapp"], message["greeting"])
+        if channel == "sms":
+            # A planned SMS may carry a shorter or GSM-7-safe text of its own
+            text = message.get("sms_greeting") or message["greeting"]
+            return send_sms(message["phone"], text, service=self.sms_service, **self.sms_kwargs)
+        if channel == "email":
+            return send_email(message["email"], self.subject, message["greeting"])
+        return False, f"Unknown channel: {channel}"
+
+    def _gated_call(self, provider, call):
+        """
+        Run `call` under a provider's circuit breaker, rate limit and
+        concurrency cap
+
+        429 responses pause the provider for its Retry-After time (or an
+        exponential backoff) before retrying. RateLimited is re-raised once
+        `max_retries` is exhausted. CircuitOpen is raised without calling
+        the provider while its breaker is open.
+        """
+        gate = self.gate(provider)
+        for attempt in range(self.max_retries + 1):
+            gate.breaker.allow()
+            gate.bucket.acquire()
+            started = time.monotonic()
+            try:
+                with gate.slots:
+                    result = call()
+                gate.breaker.record(True, time.monotonic() - started)
+                return result
+            except ProviderUnavailable:
+                gate.breaker.record(False, time.monotonic() - started)
+                raise
+            except RateLimited as e:
+                # The provider answered, so it counts as up
+                gate.breaker.record(True, time.monotonic() - started)
+                delay = e.retry_after
+                if delay is None:
+                    delay = self.backoff * (2 ** attempt) + random.uniform(0, self.backoff)
+                gate.bucket.pause(delay)
+                if attempt == self.max_retries:
+                    raise
+                registry.retry(provider)
+            except Exception:
+                gate.breaker.record(True, time.monotonic() - started)
+                raise
+
+    def send(self, task):
+        """
+        Send one task through its provider's gate, retrying on rate limits
+
+        Returns a (success, response_text) tuple like the messaging functions.
+        """
+        success, response_text, _, _ = self._send(task)
+        return success, response_text
+
+    def _send(self, task):
+        # Also reports whether the failure was the provider being unavailable
+        # and whether it is worth retrying later: a provider that answered
+        # with a rejection will reject the same message again
+        provider = provider_for(task["channel"], self.sms_service)
+        try:
+            success, response_text = self._gated_call(provider, lambda: self._call_provider(task))
+            return success, response_text, False, False
+        except RateLimited as e:
+            return False, f"{e} after {self.max_retries} retries", False, True
+        except ProviderUnavailable as e:
+            return False, str(e), True, True
+        except CircuitOpen as e:
+            # Retrying on a timer would only fail fast again; park it instead
+            return False, str(e), True, False
+        except Exception as e:
+            return False, str(e), False, True
+
+    def send_email_batch(self, tasks):
+        """
+        Send email tasks as one Resend batch request
+
+        Items the batch rejects fall back to individual sends. Returns a list
+        of (task, success, response_text) tuples.
+        """
+        emails = [(task["message"]["email"], task["message"]["greeting"]) for task in tasks]
+        started = time.perf_counter()
+        try:
+            results = self._gated_call("resend", lambda: send_email_batch(emails, self.subject))
+        except RateLimited as e:
+            return [(self._timed(task, started, retry=True), False, f"{e} after {self.max_retries} retries")
+                    for task in tasks]
+        except ProviderUnavailable as e:
+            return [(self._timed(task, started, True, True), False, str(e)) for task in tasks]
+        except CircuitOpen as e:
+            return [(self._timed(task, started, True, False), False, str(e)) for task in tasks]
+        except Exception as e:
+            results = [(False, str(e))] * len(tasks)
+
+        sent = []
+        for task, (success, response_text) in zip(tasks, results):
+            unavailable = retry = False
+            if not success:
+                success, response_text, unavailable, retry = self._send(task)
+            sent.append((self._timed(task, started, unavailable, retry), success, response_text))
+        return sent
+
+    def _timed(self, task, started, unavailable=False, retry=False):
+        # Results carry the provider, the seconds spent sending, whether the
+        # provider was unavailable and whether the failure is worth retrying,
+        # for the delivery log, dead letters and the send queue. Unavailable
+        # without retry means the circuit breaker was open.
+        return dict(task, provider=provider_for(task["channel"], self.sms_service),
+                    latency=time.perf_counter() - started, unavailable=unavailable, retry=retry)
+
+    def route(self, task):
+        """
+        Resolve a fallback task to its first reachable channel
+
+        The remaining reachable channels are kept on the task under
+        "fallback" and the errors of channels already tried under "errors".
+        Other tasks are returned unchanged.
+        """
+        if task["channel"] != FALLBACK:
+            return task
+        message = task["message"]
+        channels = [channel for channel in self.fallback_order if message.get(CHANNEL_FIELDS[channel])]
+        if not channels:
+            return dict(task, fallback=[], errors=[])
+        return dict(task, channel=channels[0], fallback=channels[1:], errors=[])
+
+    def _fall_back(self, task, response_text):
+        return dict(
+            task,
+            channel=task["fallback"][0],
+            fallback=task["fallback"][1:],
+            errors=task["errors"] + [f"{task['channel']}: {response_text}"],
+        )
+
+    def _send_single(self, task):
+        started = time.perf_counter()
+        success, response_text, unavailable, retry = self._send(task)
+        return [(self._timed(task, started, unavailable, retry), success, response_text)]
+
+    def run(self, tasks):
+        """
+        Send tasks concurrently, yielding (task, success, response_text) as they finish
+
+        Every provider gets its own worker pool sized to its concurrency cap,
+        so a slow or throttled provider cannot starve the others, and a
+        contact reached on several channels waits only for the slowest one.
+        A failed fallback task is resubmitted on its next channel and only
+        its final outcome is yielded, with the channel that was used. Email
+        tasks are grouped into Resend batches when `batch_email` is set.
+        Results are yielded in the caller's thread, so Streamlit calls are
+        safe inside the loop.
+        """
+        executors = {}
+        pending = set()
+
+        def submit(provider, fn, arg):
+            if provider not in executors:
+                executors[provider] = ThreadPoolExecutor(
+                    max_workers=self.gate(provider).concurrency,
+                    thread_name_prefix=f"send-{provider}",
+                )
+            pending.add(executors[provider].submit(fn, arg))
+
+        try:
+            emails = []
+            for task in tasks:
+                task = self.route(task)
+                if task["channel"] == FALLBACK:
+                    yield dict(task, retry=False), False, "No reachable channel"
+                elif self.batch_email and task["channel"] == "email":
+                    emails.append(task)
+                    if len(emails) == RESEND_BATCH_SIZE:
+                        submit("resend", self.send_email_batch, emails)
+                        emails = []
+                else:
+                    submit(provider_for(task["channel"], self.sms_service), self._send_single, task)
+            if emails:
+                submit("resend", self.send_email_batch, emails)
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                pending.difference_update(done)
+                for future in done:
+                    for task, success, response_text in future.result():
+                        if not success and task.get("fallback"):
+                            task = self._fall_back(task, response_text)
+                            submit(provider_for(task["channel"], self.sms_service), self._send_single, task)
+                            continue
+                        if not success and task.get("errors"):
+                            response_text = "; ".join(task["errors"] + [f"{task['channel']}: {response_text}"])
+                        yield task, success, response_text
+        finally:
+            for executor in executors.values():
+                executor.shutdown(wait=False, cancel_futures=True)
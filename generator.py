@@ -0,0 +1,129 @@
+import hashlib
+
+import pandas as pd
+
+from translator import translate_templates
+
+# Contact column -> message column
+MESSAGE_COLUMNS = {
+    "Name": "name",
+    "Email": "email",
+    "Phone": "phone",
+    "WhatsApp": "whatsapp",
+    "Language": "language",
+    "Country": "country",
+}
+
+# Columns that identify a message when deduplicating
+MESSAGE_KEY = ["name", "email", "phone", "whatsapp", "language"]
+
+
+def render_template(template, names, placeholder="{name}"):
+    """
+    Fill `placeholder` in `template` with each name, using vectorized string concatenation
+    """
+    parts = template.split(placeholder)
+    greetings = pd.Series(parts[0], index=names.index, dtype=object)
+    for part in parts[1:]:
+        greetings = greetings + names + part
+    return greetings
+
+
+def template_version(template):
+    """
+    Short content hash identifying a greeting template
+    """
+    return hashlib.sha1(template.encode()).hexdigest()[:12]
+
+
+def contact_hashes(messages):
+    """
+    Content hash of each message's contact fields, as hex strings
+    """
+    hashes = pd.util.hash_pandas_object(messages[list(MESSAGE_COLUMNS.values())], index=False)
+    return hashes.map("{:016x}".format)
+
+
+def build_messages(contacts, greeting_template, translate=translate_templates, previous=None):
+    """
+    Build one greeting per contact as a column-oriented DataFrame
+
+    The template is translated once per language, then names are filled in
+    for each language group with vectorized string operations. Missing
+    contact fields become empty strings, Language and Country are stored as
+    categoricals, and duplicate contacts produce a single message.
+
+    Each message records its template version and a hash of its contact
+    fields. Given the `previous` result, greetings for unchanged contacts
+    under the same template are reused, so only new or edited contacts are
+    rendered and only their languages translated. The number rendered is
+    left in `messages.attrs["rendered"]`.
+    """
+    messages = pd.DataFrame(
+        {
+            # Via object so categorical columns can take "" for missing values
+            column: contacts[source].astype(object).fillna("").astype(str) if source in contacts else ""
+            for source, column in MESSAGE_COLUMNS.items()
+        },
+        index=contacts.index,
+    )
+    messages = messages.drop_duplicates(subset=MESSAGE_KEY, ignore_index=True)
+    version = template_version(greeting_template)
+    messages["template"] = version
+    messages["contact_hash"] = contact_hashes(messages)
+
+    greetings = pd.Series("", index=messages.index, dtype=object)
+    fresh = pd.Series(True, index=messages.index)
+    if previous is not None and {"template", "contact_hash", "greeting"} <= set(previous.columns):
+        known = previous[previous["template"] == version].drop_duplicates("contact_hash")
+        reused = messages["contact_hash"].map(known.set_index("contact_hash")["greeting"])
+        fresh = reused.isna()
+        greetings[~fresh] = reused[~fresh]
+
+    pending = messages[fresh]
+    if len(pending):
+        templates = translate(greeting_template, pending["language"].unique())
+        for language, names in pending.groupby("language", sort=False)["name"]:
+            greetings.loc[names.index] = render_template(templates[language], names)
+    messages["greeting"] = greetings
+    messages.attrs["rendered"] = int(fresh.sum())
+
+    messages["language"] = messages["language"].astype("category")
+    messages["country"] = messages["country"].astype("category")
+    return messages
+
+
+def build_messages_from_chunks(chunks, greeting_template, translate=translate_templates, previous=None):
+    """
+    Build messages from contacts read a chunk at a time, such as
+    ContactStore.iter_chunks(), so the whole contact list is never loaded
+
+    Each language is translated once for the whole run. Returns the same
+    DataFrame build_messages would for all the contacts at once.
+    """
+    templates = {}
+
+    def translate_once(template, languages):
+        missing = [language for language in languages if language not in templates]
+        if missing:
+            templates.update(translate(template, missing))
+        return templates
+
+    parts = [build_messages(chunk, greeting_template, translate_once, previous) for chunk in chunks]
+    if not parts:
+        return build_messages(pd.DataFrame(columns=list(MESSAGE_COLUMNS)), greeting_template, translate_once)
+    rendered = sum(part.attrs["rendered"] for part in parts)
+    messages = pd.concat(parts, ignore_index=True).drop_duplicates(subset=MESSAGE_KEY, ignore_index=True)
+    messages["language"] = messages["language"].astype(str).astype("category")
+    messages["country"] = messages["country"].astype(str).astype("category")
+    messages.attrs["rendered"] = rendered
+    return messages
+
+
+def message_records(messages):
+    """
+    Return messages as a list of dicts, whether stored as a DataFrame or already a list
+    """
+    if isinstance(messages, pd.DataFrame):
+        return messages.astype(object).to_dict("records")
+    return messages
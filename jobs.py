@@ -0,0 +1,181 @@
+import threading
+import time
+from collections import deque
+
+from dispatcher import Dispatcher
+from send_queue import PENDING, SendQueue, process_queue
+
+# How many recent errors a job keeps for display
+RECENT_ERRORS = 20
+
+RUNNING = "running"
+DONE = "done"
+ERROR = "error"
+
+
+class SendJob:
+    """
+    One campaign being sent in the background, with aggregated progress
+    """
+
+    def __init__(self, campaign, method, total):
+        self.campaign = campaign
+        self.method = method
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self.state = RUNNING
+        self.error = None
+        self.started_at = time.time()
+        self.finished_at = None
+        self.recent_errors = deque(maxlen=RECENT_ERRORS)
+        self._lock = threading.Lock()
+
+    def record(self, task, success, response_text):
+        # Every attempt is reported, but a message only counts once it has a
+        # final outcome; a failure still to be retried only shows as an error
+        with self._lock:
+            if success:
+                self.sent += 1
+            else:
+                if task.get("state") != PENDING:
+                    self.failed += 1
+                self.recent_errors.append(
+                    {"recipient": task["message"].get("name", "unknown"), "channel": task["channel"],
+                     "error": str(response_text)[:200]}
+                )
+
+    def finish(self, error=None):
+        with self._lock:
+            self.state = ERROR if error else DONE
+            self.error = error
+            self.finished_at = time.time()
+
+    def progress(self):
+        """
+        Snapshot of the job's counts, send rate, ETA and recent errors
+        """
+        with self._lock:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+            done = self.sent + self.failed
+            rate = done / elapsed if elapsed > 0 else 0.0
+            remaining = max(0, self.total - done)
+            return {
+                "campaign": self.campaign,
+                "method": self.method,
+                "state": self.state,
+                "error": self.error,
+                "total": self.total,
+                "sent": self.sent,
+                "failed": self.failed,
+                "remaining": remaining if self.state == RUNNING else 0,
+                "rate": rate,
+                "eta_seconds": remaining / rate if rate and self.state == RUNNING else None,
+                "elapsed_seconds": elapsed,
+                "recent_errors": list(self.recent_errors),
+            }
+
+
+class JobManager:
+    """
+    Process-wide owner of background send jobs
+
+    Jobs run on daemon threads that belong to the process rather than to a
+    Streamlit session, so closing or refreshing the browser neither stops
+    nor restarts a campaign. Submitting a campaign that is already running
+    returns the existing job. Messages go through the durable send queue, so
+    resubmitting a finished campaign only sends what is still unsent.
+    """
+
+    def __init__(self, queue_path=None):
+        self.queue_path = queue_path
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, messages, method, dispatcher=None):
+        """
+        Queue messages and start sending them in the background
+
+        Returns the campaign id, which identifies the job.
+        """
+        queue = SendQueue(self.queue_path)
+        try:
+            campaign = queue.enqueue(messages, method)
+            counts = queue.counts(campaign)
+        finally:
+            queue.close()
+        return self._start(campaign, method, counts, dispatcher)
+
+    def replay(self, campaign=None, dispatcher=None):
+        """
+        Return dead-lettered messages to the queue and send them in the background
+
+        Replays one campaign, or every campaign with dead letters. Returns
+        the ids of the campaigns being sent.
+        """
+        queue = SendQueue(self.queue_path)
+        try:
+            campaigns = {row["campaign"] for row in queue.dead_letters(campaign)}
+            queue.replay_dead_letters(campaign)
+            counts = {campaign: queue.counts(campaign) for campaign in campaigns}
+        finally:
+            queue.close()
+        return [self._start(campaign, "replay", counts[campaign], dispatcher) for campaign in sorted(campaigns)]
+
+    def _start(self, campaign, method, counts, dispatcher):
+        with self._lock:
+            job = self._jobs.get(campaign)
+            if job and job.state == RUNNING:
+                return campaign
+            job = SendJob(campaign, method, counts["pending"] + counts["in_flight"])
+            self._jobs[campaign] = job
+
+        thread = threading.Thread(
+            target=self._run,
+            args=(job, dispatcher or Dispatcher()),
+            name=f"send-job-{campaign}",
+            daemon=True,
+        )
+        thread.start()
+        return campaign
+
+    def _run(self, job, dispatcher):
+        queue = SendQueue(self.queue_path)
+        try:
+            process_queue(queue, dispatcher, campaign=job.campaign, on_result=job.record)
+            job.finish()
+        except Exception as e:
+            job.finish(str(e))
+        finally:
+            queue.close()
+
+    def progress(self, campaign):
+        with self._lock:
+            job = self._jobs.get(campaign)
+        return job.progress() if job else None
+
+    def jobs(self):
+        """
+        Progress of every job this process has run, most recent first
+        """
+        with self._lock:
+            jobs = sorted(self._jobs.values(), key=lambda job: job.started_at, reverse=True)
+        return [job.progress() for job in jobs]
+
+    def active(self):
+        return [progress for progress in self.jobs() if progress["state"] == RUNNING]
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_job_manager():
+    """
+    Return the process-wide job manager, shared by every Streamlit session
+    """
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager()
+        return _manager
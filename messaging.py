@@ -1,15 +1,133 @@
-import requests
-import streamlit as st
-
-# Hardcoded API Keys
-TEXTBEE_API_KEY = st.secrets["TEXTBEE_API_KEY"]
-RESEND_API_KEY = st.secrets["RESEND_API_KEY"]
-GREENAPI_INSTANCE_ID = st.secrets["GREENAPI_INSTANCE_ID"]
-GREENAPI_API_TOKEN = st.secrets["GREENAPI_API_TOKEN"]
-TWILIO_SID = st.secrets["TWILIO_SID"]
-TWILIO_AUTH_TOKEN = st.secrets["TWILIO_AUTH_TOKEN"]
-TWILIO_PHONE_NUMBER = st.secrets["TWILIO_PHONE_NUMBER"]
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+import json
+import threading
+import time
 
+from config import get_setting
+from metrics import instrument, registry
+
+# API keys, from the environment, .env or .streamlit/secrets.toml
+TEXTBEE_API_KEY = get_setting("TEXTBEE_API_KEY")
+RESEND_API_KEY = get_setting("RESEND_API_KEY")
+GREENAPI_INSTANCE_ID = get_setting("GREENAPI_INSTANCE_ID")
+GREENAPI_API_TOKEN = get_setting("GREENAPI_API_TOKEN")
+TWILIO_SID = get_setting("TWILIO_SID")
+TWILIO_AUTH_TOKEN = get_setting("TWILIO_AUTH_TOKEN")
+TWILIO_PHONE_NUMBER = get_setting("TWILIO_PHONE_NUMBER")
+
+# Provider endpoints; override for self-hosted gateways or local load tests
+GREENAPI_URL = get_setting("GREENAPI_URL", "https://api.green-api.com")
+TEXTBELT_URL = get_setting("TEXTBELT_URL", "https://textbelt.com/text")
+RESEND_URL = get_setting("RESEND_URL", "https://api.resend.com")
+TWILIO_API_URL = get_setting("TWILIO_API_URL")
+
+# (connect, read) timeouts in seconds for every provider request
+REQUEST_TIMEOUT = (5, 30)
+# Keep-alive connections kept open per provider
+POOL_SIZE = 10
+# Most emails Resend accepts in a single batch request
+RESEND_BATCH_SIZE = 100
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def get_session(provider):
+    """
+    Return the pooled keep-alive HTTP session for a provider
+
+    Sessions are created on first use and shared by every send to that
+    provider, so TCP and TLS handshakes happen once per pooled connection
+    rather than once per message. Every response's status code is counted
+    in the metrics registry.
+    """
+    with _sessions_lock:
+        session = _sessions.get(provider)
+        if session is None:
+            # Imported on first send so headless runs start quickly
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            session.hooks["response"].append(
+                lambda response, *args, provider=provider, **kwargs: registry.status(provider, response.status_code)
+            )
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[provider] = session
+        return session
+
+@lru_cache(maxsize=8)
+def get_twilio_client(account_sid, auth_token):
+    """
+    Return a Twilio client for a credential set, built once and reused
+    """
+    from twilio.http.http_client import TwilioHttpClient
+    from twilio.rest import Client
+
+    http_client = TwilioHttpClient(pool_connections=True, timeout=REQUEST_TIMEOUT[1])
+    client = Client(account_sid, auth_token, http_client=http_client)
+    if TWILIO_API_URL:
+        client.api.base_url = TWILIO_API_URL
+    return client
+
+class RateLimited(Exception):
+    """
+    Raised when a provider answers 429 Too Many Requests
+
+    `retry_after` holds the number of seconds the provider asked us to wait,
+    or None if it did not say.
+    """
+    def __init__(self, provider, retry_after=None):
+        super().__init__(f"{provider} rate limit exceeded")
+        self.provider = provider
+        self.retry_after = retry_after
+
+class ProviderUnavailable(Exception):
+    """
+    Raised when a provider cannot take requests right now: a network error,
+    a timeout or a 5xx response, as opposed to rejecting one message
+    """
+    def __init__(self, provider, detail):
+        super().__init__(f"{provider} unavailable: {detail}")
+        self.provider = provider
+        self.detail = detail
+
+def _check_available(provider, response):
+    if response.status_code >= 500:
+        raise ProviderUnavailable(provider, f"HTTP {response.status_code} {response.text[:200]}")
+
+def _unavailable(provider, e):
+    """
+    ProviderUnavailable for network-level failures, None for anything else
+    """
+    import requests
+
+    if isinstance(e, (requests.ConnectionError, requests.Timeout)):
+        return ProviderUnavailable(provider, str(e))
+    return None
+
+def _retry_after(response):
+    """
+    Parse a Retry-After header given either in seconds or as an HTTP date
+    """
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def _sms_provider(args, kwargs):
+    return (args[2] if len(args) > 2 else kwargs.get("service", "textbelt")).lower()
+
+@instrument("greenapi")
 def send_whatsapp(phone_number, message):
     """
     Send WhatsApp message using GreenAPI
@@ -19,18 +137,27 @@ def send_whatsapp(phone_number, message):
         whatsapp_number = phone_number.replace("+", "")
         
         # Use the correct API endpoint
-        url = f"https://api.green-api.com/waInstance{GREENAPI_INSTANCE_ID}/sendMessage/{GREENAPI_API_TOKEN}"
+        url = f"{GREENAPI_URL}/waInstance{GREENAPI_INSTANCE_ID}/sendMessage/{GREENAPI_API_TOKEN}"
         
         payload = {
             "chatId": f"{whatsapp_number}@c.us",
             "message": message
         }
         
-        response = requests.post(url, json=payload)
+        response = get_session("greenapi").post(url, json=payload, timeout=REQUEST_TIMEOUT)
+        if response.status_code == 429:
+            raise RateLimited("greenapi", _retry_after(response))
+        _check_available("greenapi", response)
         return response.status_code == 200, response.text
+    except (RateLimited, ProviderUnavailable):
+        raise
     except Exception as e:
+        unavailable = _unavailable("greenapi", e)
+        if unavailable:
+            raise unavailable from e
         return False, str(e)
 
+@instrument(_sms_provider)
 def send_sms(phone_number, message, service="textbelt", **kwargs):
     """
     Send SMS using various services
@@ -51,34 +178,36 @@ def send_sms(phone_number, message, service="textbelt", **kwargs):
         
         # TextBelt service
         if service.lower() == "textbelt":
-            textbelt_url = "https://textbelt.com/text"
+            textbelt_url = TEXTBELT_URL
             textbelt_payload = {
                 "phone": phone_number,
                 "message": message,
                 "key": "textbelt"  # Free test key - one message per day
             }
             
-            response = requests.post(textbelt_url, data=textbelt_payload)
+            response = get_session("textbelt").post(textbelt_url, data=textbelt_payload, timeout=REQUEST_TIMEOUT)
+            if response.status_code == 429:
+                raise RateLimited("textbelt", _retry_after(response))
+            _check_available("textbelt", response)
             response_data = response.json()
             
             if response_data.get("success"):
-                return True, f"Message sent successfully. Quota remaining: {response_data.get('quotaRemaining', 'unknown')}"
+                # The JSON body carries textId, the provider's message id
+                return True, response.text
             else:
                 return False, f"SMS service failed. Error: {response_data.get('error', 'Unknown error')}"
         
         # Twilio service
         elif service.lower() == "twilio":
-            from twilio.rest import Client
-            
-            # Get Twilio credentials from kwargs
-            account_sid = kwargs.get('twilio_sid')
-            auth_token = kwargs.get('twilio_token')
-            from_number = kwargs.get('twilio_number')
+            # Get Twilio credentials from kwargs, falling back to the configured ones
+            account_sid = kwargs.get('twilio_sid') or TWILIO_SID
+            auth_token = kwargs.get('twilio_token') or TWILIO_AUTH_TOKEN
+            from_number = kwargs.get('twilio_number') or TWILIO_PHONE_NUMBER
             
             if not all([account_sid, auth_token, from_number]):
                 return False, "Missing Twilio credentials"
             
-            client = Client(account_sid, auth_token)
+            client = get_twilio_client(account_sid, auth_token)
             
             message = client.messages.create(
                 body=message,
@@ -86,7 +215,7 @@ def send_sms(phone_number, message, service="textbelt", **kwargs):
                 to=phone_number
             )
             
-            return True, f"Message sent with Twilio SID: {message.sid}"
+            return True, json.dumps({"sid": message.sid, "status": message.status})
         
         # TextBee service
         elif service.lower() == "textbee":
@@ -96,39 +225,98 @@ def send_sms(phone_number, message, service="textbelt", **kwargs):
         else:
             return False, f"Unknown SMS service: {service}"
     
+    except (RateLimited, ProviderUnavailable):
+        raise
     except Exception as e:
+        # Twilio reports throttling and outages through TwilioRestException.status
+        status = getattr(e, "status", None)
+        if status == 429:
+            raise RateLimited("twilio") from e
+        if isinstance(status, int) and status >= 500:
+            raise ProviderUnavailable("twilio", str(e)) from e
+        unavailable = _unavailable(service.lower(), e)
+        if unavailable:
+            raise unavailable from e
         return False, f"Exception: {str(e)}"
 
+def _email_payload(email, subject, message):
+    return {
+        "from": "onboarding@resend.dev",  # Use Resend's default verified sender
+        "to": email,
+        "subject": subject,
+        "html": f"<p>{message}</p>"
+    }
+
+@instrument("resend")
 def send_email(email, subject, message):
     """
     Send email using Resend
     """
     try:
-        url = "https://api.resend.com/emails"
+        url = f"{RESEND_URL}/emails"
         headers = {
             "Authorization": f"Bearer {RESEND_API_KEY}",
             "Content-Type": "application/json"
         }
-        payload = {
-            "from": "onboarding@resend.dev",  # Use Resend's default verified sender
-            "to": email,
-            "subject": subject,
-            "html": f"<p>{message}</p>"
-        }
-        response = requests.post(url, headers=headers, json=payload)
+        payload = _email_payload(email, subject, message)
+        response = get_session("resend").post(url, headers=headers, json=payload, timeout=REQUEST_TIMEOUT)
+        if response.status_code == 429:
+            raise RateLimited("resend", _retry_after(response))
+        _check_available("resend", response)
         return response.status_code == 200, response.text
+    except (RateLimited, ProviderUnavailable):
+        raise
     except Exception as e:
+        unavailable = _unavailable("resend", e)
+        if unavailable:
+            raise unavailable from e
         return False, str(e)
 
-
-
-
-
-
-
-
-
-
-
-
-
+@instrument("resend")
+def send_email_batch(emails, subject):
+    """
+    Send up to RESEND_BATCH_SIZE emails in one request to Resend's batch endpoint
+    
+    Parameters:
+    - emails (list): (email, message) pairs
+    - subject (str): Subject line shared by every email
+    
+    Returns:
+    - list: (success_boolean, response_message) tuples in the same order as `emails`.
+      Permissive validation is used, so one bad address only fails its own item.
+    """
+    if len(emails) > RESEND_BATCH_SIZE:
+        raise ValueError(f"Resend batches hold at most {RESEND_BATCH_SIZE} emails")
+    try:
+        url = f"{RESEND_URL}/emails/batch"
+        headers = {
+            "Authorization": f"Bearer {RESEND_API_KEY}",
+            "Content-Type": "application/json",
+            "x-batch-validation": "permissive"
+        }
+        payload = [_email_payload(email, subject, message) for email, message in emails]
+        response = get_session("resend").post(url, headers=headers, json=payload, timeout=REQUEST_TIMEOUT)
+        if response.status_code == 429:
+            raise RateLimited("resend", _retry_after(response))
+        _check_available("resend", response)
+        if response.status_code != 200:
+            return [(False, response.text)] * len(emails)
+        
+        body = response.json()
+        errors = {error["index"]: error.get("message", "Rejected") for error in body.get("errors") or []}
+        # Ids in "data" belong to the accepted items, in request order
+        ids = iter(body.get("data") or [])
+        results = []
+        for index in range(len(emails)):
+            if index in errors:
+                results.append((False, errors[index]))
+            else:
+                results.append((True, json.dumps(next(ids, {}))))
+        return results
+    except (RateLimited, ProviderUnavailable):
+        raise
+    except Exception as e:
+        unavailable = _unavailable("resend", e)
+        if unavailable:
+            raise unavailable from e
+        return [(False, str(e))] * len(emails)
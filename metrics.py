@@ -0,0 +1,302 @@
+import functools
+import os
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Seconds of history behind the messages-per-second figure
+RATE_WINDOW = 60
+QUANTILES = (0.5, 0.95, 0.99)
+METRICS_PATH = "metrics.prom"
+
+SUCCESS = "success"
+ERROR = "error"
+RATE_LIMITED = "rate_limited"
+
+
+class Series:
+    """
+    Latency histogram, outcome counts and recent throughput for one
+    (operation, provider) pair
+    """
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.requests = 0
+        self.outcomes = Counter()
+        self.retries = 0
+        self._recent = deque()
+
+    def observe(self, seconds, outcomes):
+        """
+        Record one request taking `seconds` and its per-message outcomes
+        """
+        index = next((i for i, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound), len(LATENCY_BUCKETS))
+        self.buckets[index] += 1
+        self.latency_sum += seconds
+        self.requests += 1
+        self.outcomes.update(outcomes)
+
+        now = int(time.time())
+        if self._recent and self._recent[-1][0] == now:
+            self._recent[-1][1] += len(outcomes)
+        else:
+            self._recent.append([now, len(outcomes)])
+        while self._recent and self._recent[0][0] <= now - RATE_WINDOW:
+            self._recent.popleft()
+
+    def rate(self):
+        """
+        Messages per second over the last RATE_WINDOW seconds, or since the
+        first message if that was more recent
+        """
+        now = time.time()
+        recent = [(second, count) for second, count in self._recent if second > now - RATE_WINDOW]
+        if not recent:
+            return 0.0
+        return sum(count for _, count in recent) / max(1.0, now - recent[0][0])
+
+    def quantile(self, q):
+        """
+        Estimate a latency quantile by interpolating within its bucket, the
+        way Prometheus' histogram_quantile does
+        """
+        if not self.requests:
+            return None
+        rank = q * self.requests
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            if seen + count >= rank and count:
+                if i == len(LATENCY_BUCKETS):
+                    return LATENCY_BUCKETS[-1]
+                lower = LATENCY_BUCKETS[i - 1] if i else 0.0
+                return lower + (LATENCY_BUCKETS[i] - lower) * (rank - seen) / count
+            seen += count
+        return LATENCY_BUCKETS[-1]
+
+
+class Registry:
+    """
+    Thread-safe store of send and translation metrics for this process
+    """
+
+    def __init__(self):
+        self._series = {}
+        self._status_codes = Counter()
+        self._lock = threading.Lock()
+
+    def _get(self, operation, provider):
+        key = (operation, provider)
+        if key not in self._series:
+            self._series[key] = Series()
+        return self._series[key]
+
+    def observe(self, operation, provider, seconds, outcomes):
+        with self._lock:
+            self._get(operation, provider).observe(seconds, outcomes)
+
+    def retry(self, provider, operation="send"):
+        with self._lock:
+            self._get(operation, provider).retries += 1
+
+    def status(self, provider, code):
+        with self._lock:
+            self._status_codes[(provider, code)] += 1
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+            self._status_codes.clear()
+
+    def snapshot(self):
+        """
+        One summary row per (operation, provider): counts, retries,
+        messages per second and latency quantiles in seconds
+        """
+        with self._lock:
+            rows = []
+            for (operation, provider), series in sorted(self._series.items()):
+                row = {
+                    "operation": operation,
+                    "provider": provider,
+                    "requests": series.requests,
+                    "success": series.outcomes[SUCCESS],
+                    "error": series.outcomes[ERROR],
+                    "rate_limited": series.outcomes[RATE_LIMITED],
+                    "retries": series.retries,
+                    "msg_per_sec": series.rate(),
+                }
+                for q in QUANTILES:
+                    row[f"p{int(q * 100)}"] = series.quantile(q)
+                rows.append(row)
+            return rows
+
+    def status_codes(self):
+        with self._lock:
+            return dict(self._status_codes)
+
+    def to_prometheus(self):
+        """
+        Render every metric in the Prometheus text exposition format
+        """
+        lines = [
+            "# HELP outreach_request_duration_seconds Provider request latency.",
+            "# TYPE outreach_request_duration_seconds histogram",
+        ]
+        with self._lock:
+            series_items = sorted(self._series.items())
+            for (operation, provider), series in series_items:
+                labels = f'operation="{operation}",provider="{provider}"'
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), series.buckets):
+                    cumulative += count
+                    lines.append(f'outreach_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f"outreach_request_duration_seconds_sum{{{labels}}} {series.latency_sum}")
+                lines.append(f"outreach_request_duration_seconds_count{{{labels}}} {series.requests}")
+
+            lines += [
+                "# HELP outreach_request_latency_seconds Estimated latency quantiles.",
+                "# TYPE outreach_request_latency_seconds gauge",
+            ]
+            for (operation, provider), series in series_items:
+                for q in QUANTILES:
+                    value = series.quantile(q)
+                    if value is not None:
+                        lines.append(
+                            f'outreach_request_latency_seconds{{operation="{operation}",provider="{provider}",'
+                            f'quantile="{q}"}} {value}'
+                        )
+
+            lines += [
+                "# HELP outreach_messages_total Messages handled, by outcome.",
+                "# TYPE outreach_messages_total counter",
+            ]
+            for (operation, provider), series in series_items:
+                for outcome, count in sorted(series.outcomes.items()):
+                    lines.append(
+                        f'outreach_messages_total{{operation="{operation}",provider="{provider}",'
+                        f'outcome="{outcome}"}} {count}'
+                    )
+
+            lines += [
+                "# HELP outreach_retries_total Requests retried after a rate limit.",
+                "# TYPE outreach_retries_total counter",
+            ]
+            for (operation, provider), series in series_items:
+                lines.append(f'outreach_retries_total{{operation="{operation}",provider="{provider}"}} {series.retries}')
+
+            lines += [
+                "# HELP outreach_messages_per_second Messages handled per second over the last minute.",
+                "# TYPE outreach_messages_per_second gauge",
+            ]
+            for (operation, provider), series in series_items:
+                lines.append(
+                    f'outreach_messages_per_second{{operation="{operation}",provider="{provider}"}} {series.rate()}'
+                )
+
+            lines += [
+                "# HELP outreach_http_responses_total Provider HTTP responses, by status code.",
+                "# TYPE outreach_http_responses_total counter",
+            ]
+            for (provider, code), count in sorted(self._status_codes.items()):
+                lines.append(f'outreach_http_responses_total{{provider="{provider}",code="{code}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def _failure(e):
+    # Checked by name so this module does not depend on the messaging module
+    return RATE_LIMITED if type(e).__name__ == "RateLimited" else ERROR
+
+
+def _outcomes(result):
+    # Senders return (success, text), batch senders a list of those
+    if isinstance(result, list):
+        return [SUCCESS if success else ERROR for success, _ in result]
+    if isinstance(result, tuple):
+        return [SUCCESS if result[0] else ERROR]
+    return [SUCCESS]
+
+
+@contextmanager
+def track(operation, provider, messages=1):
+    """
+    Time the enclosed block as one request for `messages` messages
+
+    An exception counts every message as an error, or as rate limited when
+    it is the messaging module's RateLimited, and is re-raised.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        registry.observe(operation, provider, time.perf_counter() - started, [_failure(e)] * messages)
+        raise
+    registry.observe(operation, provider, time.perf_counter() - started, [SUCCESS] * messages)
+
+
+def instrument(provider, operation="send"):
+    """
+    Decorate a sender so each call records its latency and outcomes
+
+    `provider` is a name, or a function of the call's (args, kwargs)
+    returning one, for senders that serve several providers.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            name = provider(args, kwargs) if callable(provider) else provider
+            started = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                registry.observe(operation, name, time.perf_counter() - started, [_failure(e)])
+                raise
+            registry.observe(operation, name, time.perf_counter() - started, _outcomes(result))
+            return result
+        return wrapper
+    return decorator
+
+
+def write_prometheus(path=METRICS_PATH):
+    """
+    Write the current metrics to a file, e.g. for node_exporter's textfile collector
+    """
+    with open(f"{path}.tmp", "w") as f:
+        f.write(registry.to_prometheus())
+    # Replace atomically so a scraper never reads a half-written file
+    os.replace(f"{path}.tmp", path)
+    return path
+
+
+def serve_metrics(port, host="0.0.0.0"):
+    """
+    Serve the metrics at http://host:port/metrics from a daemon thread
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.to_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
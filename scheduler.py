@@ -1,65 +1,345 @@
-import requests
-import pandas as pd
 import os
-from dotenv import load_dotenv
-from messaging import send_whatsapp, send_sms, send_email
+from dispatcher import Dispatcher
+from send_queue import SendQueue, process_queue, default_worker_id
+from metrics import serve_metrics, write_prometheus
+from suppression import get_recipient_index, SUPPRESSED, BOUNCED
+import argparse
 import json
+import multiprocessing
+import threading
+import time
 from datetime import datetime
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
-# Load environment variables
-load_dotenv()
+# Longest the daemon sleeps before re-checking the queue for campaigns that
+# other processes (e.g. the Streamlit app) scheduled earlier than its next wake-up
+RESCAN_SECONDS = 30
 
-def send_scheduled_messages(method="all"):
+# Time zone used for each country in local-time mode, keyed by lowercase
+# country name or ISO 3166 alpha-2 code. Countries spanning several zones use
+# their most populous one.
+COUNTRY_TIMEZONES = {
+    "us": "America/New_York", "usa": "America/New_York", "united states": "America/New_York",
+    "ca": "America/Toronto", "canada": "America/Toronto",
+    "mx": "America/Mexico_City", "mexico": "America/Mexico_City",
+    "br": "America/Sao_Paulo", "brazil": "America/Sao_Paulo",
+    "ar": "America/Argentina/Buenos_Aires", "argentina": "America/Argentina/Buenos_Aires",
+    "gb": "Europe/London", "uk": "Europe/London", "united kingdom": "Europe/London",
+    "ie": "Europe/Dublin", "ireland": "Europe/Dublin",
+    "fr": "Europe/Paris", "france": "Europe/Paris",
+    "es": "Europe/Madrid", "spain": "Europe/Madrid",
+    "pt": "Europe/Lisbon", "portugal": "Europe/Lisbon",
+    "de": "Europe/Berlin", "germany": "Europe/Berlin",
+    "it": "Europe/Rome", "italy": "Europe/Rome",
+    "nl": "Europe/Amsterdam", "netherlands": "Europe/Amsterdam",
+    "be": "Europe/Brussels", "belgium": "Europe/Brussels",
+    "ch": "Europe/Zurich", "switzerland": "Europe/Zurich",
+    "at": "Europe/Vienna", "austria": "Europe/Vienna",
+    "se": "Europe/Stockholm", "sweden": "Europe/Stockholm",
+    "pl": "Europe/Warsaw", "poland": "Europe/Warsaw",
+    "tr": "Europe/Istanbul", "turkey": "Europe/Istanbul",
+    "ru": "Europe/Moscow", "russia": "Europe/Moscow",
+    "eg": "Africa/Cairo", "egypt": "Africa/Cairo",
+    "ng": "Africa/Lagos", "nigeria": "Africa/Lagos",
+    "ke": "Africa/Nairobi", "kenya": "Africa/Nairobi",
+    "za": "Africa/Johannesburg", "south africa": "Africa/Johannesburg",
+    "ae": "Asia/Dubai", "uae": "Asia/Dubai", "united arab emirates": "Asia/Dubai",
+    "sa": "Asia/Riyadh", "saudi arabia": "Asia/Riyadh",
+    "pk": "Asia/Karachi", "pakistan": "Asia/Karachi",
+    "in": "Asia/Kolkata", "india": "Asia/Kolkata",
+    "bd": "Asia/Dhaka", "bangladesh": "Asia/Dhaka",
+    "np": "Asia/Kathmandu", "nepal": "Asia/Kathmandu",
+    "lk": "Asia/Colombo", "sri lanka": "Asia/Colombo",
+    "th": "Asia/Bangkok", "thailand": "Asia/Bangkok",
+    "vn": "Asia/Ho_Chi_Minh", "vietnam": "Asia/Ho_Chi_Minh",
+    "id": "Asia/Jakarta", "indonesia": "Asia/Jakarta",
+    "my": "Asia/Kuala_Lumpur", "malaysia": "Asia/Kuala_Lumpur",
+    "sg": "Asia/Singapore", "singapore": "Asia/Singapore",
+    "ph": "Asia/Manila", "philippines": "Asia/Manila",
+    "cn": "Asia/Shanghai", "china": "Asia/Shanghai",
+    "hk": "Asia/Hong_Kong", "hong kong": "Asia/Hong_Kong",
+    "tw": "Asia/Taipei", "taiwan": "Asia/Taipei",
+    "jp": "Asia/Tokyo", "japan": "Asia/Tokyo",
+    "kr": "Asia/Seoul", "south korea": "Asia/Seoul", "korea": "Asia/Seoul",
+    "au": "Australia/Sydney", "australia": "Australia/Sydney",
+    "nz": "Pacific/Auckland", "new zealand": "Pacific/Auckland",
+}
+
+def country_timezone(country):
+    """
+    Time zone for a country name or ISO code, or None if unknown
+    """
+    name = COUNTRY_TIMEZONES.get(str(country or "").strip().lower())
+    if not name:
+        return None
+    try:
+        return ZoneInfo(name)
+    except ZoneInfoNotFoundError:
+        return None
+
+def send_times(messages, start, window_seconds=0, local_time=False):
+    """
+    Compute the due timestamp for each message
+
+    Parameters:
+    - messages (list): Message dicts, as stored in messages.json
+    - start (datetime): When to start sending. Naive datetimes are read in the
+      server's time zone, or in each recipient's time zone when `local_time` is set
+    - window_seconds (float): Spread the campaign evenly over this many seconds
+    - local_time (bool): Send at `start` wall-clock time in each recipient's
+      country (from the "country" field); unknown countries use the server's zone
+
+    Returns:
+    - list: One Unix timestamp per message
+    """
+    count = len(messages)
+    step = window_seconds / count if count and window_seconds else 0
+    base_times = {}
+    times = []
+    for index, message in enumerate(messages):
+        country = message.get("country", "") if local_time else ""
+        if country not in base_times:
+            zone = country_timezone(country) if local_time else None
+            base = start.replace(tzinfo=zone) if zone and start.tzinfo is None else start
+            base_times[country] = base.timestamp()
+        times.append(base_times[country] + index * step)
+    return times
+
+def schedule_campaign(messages, start, method="all", window_seconds=0, local_time=False, queue=None, shard=None):
+    """
+    Queue messages to be sent from `start`, optionally spread over a window
+
+    `shard` is an optional (index, count) pair; only recipients in that
+    partition are queued, as for a sharded send. Returns the campaign id. A
+    running SchedulerDaemon delivers the messages as they fall due.
+    """
+    own_queue = queue is None
+    queue = queue or SendQueue()
+    try:
+        return queue.enqueue(
+            messages,
+            method,
+            send_at=send_times(messages, start, window_seconds, local_time),
+            shard=shard,
+        )
+    finally:
+        if own_queue:
+            queue.close()
+
+def log_result(task, success, response_text):
+    if not success:
+        print(f"Error sending to {task['message'].get('name', 'unknown')}: {response_text}")
+
+def parse_shard(value):
+    """
+    Parse an "index/count" shard spec such as "0/4"
+    """
+    index, count = (int(part) for part in value.split("/"))
+    if not 0 <= index < count:
+        raise ValueError(f"Shard index must be between 0 and {count - 1}")
+    return index, count
+
+def split_shard(shard, workers):
+    """
+    Split a shard (or the whole queue) into one sub-shard per local worker
+
+    Worker j of k on shard (i, n) owns (i + n*j, n*k), so sub-shards never
+    overlap and together cover the parent shard exactly.
+    """
+    index, count = shard or (0, 1)
+    return [(index + count * worker, count * workers) for worker in range(workers)]
+
+def _shard_worker(queue_path, campaign, shard, limits, worker, sms_service):
+    queue = SendQueue(queue_path)
+    try:
+        dispatcher = Dispatcher(limits=limits, worker=worker, sms_service=sms_service)
+        return process_queue(queue, dispatcher, campaign=campaign, shard=shard, on_result=log_result)
+    finally:
+        queue.close()
+
+def send_sharded(queue, campaign, workers, shard=None, limits=None, sms_service="textbelt"):
+    """
+    Send a queued campaign with `workers` processes sharing the queue
+
+    Each process owns one partition of recipients by stable hash and claims
+    only from it, so every message has exactly one owner. Provider limits
+    are divided between the processes (see Dispatcher). Returns the total
+    sent.
+    """
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(workers) as pool:
+        counts = pool.starmap(
+            _shard_worker,
+            [(queue.path, campaign, sub_shard, limits, (worker, workers), sms_service)
+             for worker, sub_shard in enumerate(split_shard(shard, workers))],
+        )
+    return sum(counts)
+
+class SchedulerDaemon:
+    """
+    Long-running sender for scheduled campaigns
+
+    Scheduled messages live in the send queue, indexed by due time, so the
+    daemon holds nothing in memory between batches. It sleeps until the
+    earliest due message (or RESCAN_SECONDS, whichever comes first), sends
+    everything that is due, and goes back to sleep. Call `wake()` after
+    scheduling from the same process to re-plan immediately.
+    """
+    def __init__(self, queue=None, dispatcher=None, batch_size=100, shard=None):
+        self.queue = queue or SendQueue()
+        self.dispatcher = dispatcher or Dispatcher()
+        self.batch_size = batch_size
+        self.shard = shard
+        self.worker_id = default_worker_id()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def run_due(self):
+        """
+        Send every message that is currently due, returning the number sent
+        """
+        sent_count = process_queue(
+            self.queue,
+            self.dispatcher,
+            batch_size=self.batch_size,
+            worker_id=self.worker_id,
+            on_result=log_result,
+            shard=self.shard,
+        )
+        if sent_count:
+            write_prometheus()
+        return sent_count
+
+    def seconds_until_due(self):
+        # Only this daemon's shard: another shard's due messages are not ours to wait on
+        next_due = self.queue.next_due(shard=self.shard)
+        if next_due is None:
+            return RESCAN_SECONDS
+        return min(RESCAN_SECONDS, max(0.0, next_due - time.time()))
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            try:
+                self.run_due()
+            except Exception as e:
+                with open("error_log.txt", "a") as f:
+                    f.write(f"{datetime.now()}: Error: {str(e)}\n")
+            self._wake.wait(self.seconds_until_due())
+            self._wake.clear()
+
+def send_scheduled_messages(method="all", workers=1, shard=None, sms_service="textbelt", limits=None):
     """
     Send scheduled messages - this function can be called by a cron job
+
+    `workers` > 1 splits the run across that many processes. `shard` is an
+    (index, count) pair that limits this run to one partition of
+    recipients, for spreading a campaign over several hosts. SMS go through
+    `sms_service`, and `limits` overrides provider limits as for Dispatcher.
     """
     try:
-        # Load contacts and messages
-        if os.path.exists("contacts.csv") and os.path.exists("messages.json"):
-            contacts_df = pd.read_csv("contacts.csv")
+        # Load messages
+        if os.path.exists("messages.json"):
             with open("messages.json", "r") as f:
                 messages = json.load(f)
-            
-            sent_count = 0
-            
-            for message in messages:
-                try:
-                    if (method == "whatsapp" or method == "all") and message.get("whatsapp"):
-                        success, _ = send_whatsapp(message["whatsapp"], message["greeting"])
-                        if success:
-                            sent_count += 1
-                    
-                    if (method == "sms" or method == "all") and message.get("phone"):
-                        success, _ = send_sms(message["phone"], message["greeting"])
-                        if success:
-                            sent_count += 1
-                    
-                    if (method == "email" or method == "all") and message.get("email"):
-                        success, _ = send_email(
-                            message["email"], 
-                            "Seasonal Greetings", 
-                            message["greeting"]
-                        )
-                        if success:
-                            sent_count += 1
-                
-                except Exception as e:
-                    print(f"Error sending to {message.get('name', 'unknown')}: {str(e)}")
-            
-            # Log the results
-            with open("send_log.txt", "a") as f:
-                f.write(f"{datetime.now()}: Sent {sent_count} out of {len(messages)} messages via {method}\n")
-            
+
+            # Queue every (message, channel) once; messages already sent by an
+            # earlier or interrupted run are skipped
+            queue = SendQueue()
+            campaign = queue.enqueue(messages, method, shard=shard)
+
+            if workers > 1:
+                sent_count = send_sharded(queue, campaign, workers, shard, limits=limits, sms_service=sms_service)
+            else:
+                sent_count = process_queue(queue, Dispatcher(limits=limits, sms_service=sms_service),
+                                           campaign=campaign, on_result=log_result, shard=shard)
+            queue.close()
+
             return {"success": True, "sent": sent_count, "total": len(messages)}
         else:
-            return {"success": False, "error": "Contact or message files not found"}
-    
+            return {"success": False, "error": "Message file not found"}
+
     except Exception as e:
         with open("error_log.txt", "a") as f:
             f.write(f"{datetime.now()}: Error: {str(e)}\n")
         return {"success": False, "error": str(e)}
 
 if __name__ == "__main__":
-    # This can be called directly by a cron job
-    result = send_scheduled_messages()
-    print(json.dumps(result))
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Send or schedule outreach messages")
+    parser.add_argument("--method", default="all", choices=["all", "fallback", "whatsapp", "sms", "email"],
+                        help="'all' sends on every channel at once, 'fallback' tries WhatsApp, then SMS, then email")
+    parser.add_argument("--sms-service", default="textbelt", choices=["textbelt", "twilio", "textbee"],
+                        help="SMS provider for sends, the daemon and dead-letter replays")
+    parser.add_argument("--serve", action="store_true", help="run the scheduler daemon")
+    parser.add_argument("--schedule", metavar="DATETIME",
+                        help="queue messages.json for this time (e.g. '2026-12-24 09:00') instead of sending now")
+    parser.add_argument("--window", type=float, default=0, help="spread a scheduled campaign over this many minutes")
+    parser.add_argument("--local-time", action="store_true",
+                        help="send at the scheduled time in each recipient's country")
+    parser.add_argument("--workers", type=int, default=1, help="number of sending processes")
+    parser.add_argument("--shard", type=parse_shard, metavar="INDEX/COUNT",
+                        help="only handle this partition of recipients, e.g. 0/3 on the first of three hosts")
+    parser.add_argument("--suppress", metavar="FILE",
+                        help="add the emails or phone numbers in FILE (one per line) to the suppression list and exit")
+    parser.add_argument("--reason", default=SUPPRESSED, choices=[SUPPRESSED, BOUNCED],
+                        help="reason recorded for --suppress")
+    parser.add_argument("--replay-dead-letters", nargs="?", const="", metavar="CAMPAIGN",
+                        help="resend messages parked while a provider was down, for one campaign or all")
+    parser.add_argument("--plan-sms", nargs="?", const="textbelt", choices=["textbelt", "twilio", "textbee"],
+                        metavar="SERVICE",
+                        help="print projected SMS segments, send time and cost for messages.json and exit")
+    parser.add_argument("--metrics-port", type=int,
+                        help="serve Prometheus metrics at http://localhost:PORT/metrics")
+    args = parser.parse_args()
+
+    if args.metrics_port:
+        serve_metrics(args.metrics_port)
+
+    if args.suppress:
+        with open(args.suppress, "r") as f:
+            added = get_recipient_index().add([line for line in f if line.strip()], args.reason)
+        print(json.dumps({"success": True, "added": added, "reason": args.reason}))
+    elif args.plan_sms:
+        # pandas is only needed here, so it stays out of the cron send path
+        from sms_planner import plan_sms
+
+        with open("messages.json", "r") as f:
+            plan = plan_sms(json.load(f), provider=args.plan_sms)
+        plan["by_language"] = plan["by_language"].to_dict("records")
+        print(json.dumps(plan, default=int))
+    elif args.replay_dead_letters is not None:
+        queue = SendQueue()
+        campaign = args.replay_dead_letters or None
+        replayed = queue.replay_dead_letters(campaign)
+        sent_count = process_queue(queue, Dispatcher(sms_service=args.sms_service), campaign=campaign,
+                                   on_result=log_result, shard=args.shard)
+        queue.close()
+        write_prometheus()
+        print(json.dumps({"success": True, "replayed": replayed, "sent": sent_count}))
+    elif args.serve:
+        SchedulerDaemon(dispatcher=Dispatcher(sms_service=args.sms_service), shard=args.shard).run_forever()
+    elif args.schedule:
+        with open("messages.json", "r") as f:
+            messages = json.load(f)
+        campaign = schedule_campaign(
+            messages,
+            datetime.fromisoformat(args.schedule),
+            method=args.method,
+            window_seconds=args.window * 60,
+            local_time=args.local_time,
+            shard=args.shard,
+        )
+        print(json.dumps({"success": True, "campaign": campaign, "total": len(messages)}))
+    else:
+        # This can be called directly by a cron job
+        result = send_scheduled_messages(args.method, workers=args.workers, shard=args.shard,
+                                         sms_service=args.sms_service)
+        # Left behind for cron runs, which exit before anything could scrape them
+        write_prometheus()
+        print(json.dumps(result))
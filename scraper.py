@@ -2,64 +2,319 @@ import requests
 from bs4 import BeautifulSoup
 import pandas as pd
 import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from urllib.parse import urljoin, urldefrag, urlparse
+from urllib.robotparser import RobotFileParser
+
+USER_AGENT = "InternationalOutreachAgent/1.0"
+REQUEST_TIMEOUT = (5, 20)
+# Minimum seconds between two requests to the same host
+HOST_DELAY = 1.0
+CRAWL_WORKERS = 8
+
+# Country code assumed for numbers written without one (the old pattern was
+# built around North American 3-3-4 numbers)
+DEFAULT_COUNTRY_CODE = "1"
+
+# Emails and phones are found by one precompiled pattern in a single scan.
+# The lookbehinds only let a match start at a token boundary, which keeps
+# the scan linear even on long runs of letters or digits.
+CONTACT_PATTERN = re.compile(
+    r"(?P<email>(?<![\w.%+-])[\w.%+-]+@[a-zA-Z0-9-]+(?:\.[a-zA-Z0-9-]+)*\.[a-zA-Z]{2,})"
+    r"|(?P<phone>(?<![\w+])(?:\+|00)?\(?\d(?:(?:[ .-]|\)[ .-]?|[ .-]?\()?\d){6,16})(?!\d)"
+)
+# Numbers without + or 00 must be grouped like a national number, e.g.
+# (212) 555-0147 or 416-595-1700; bare digit runs are usually dates, order
+# or reference numbers
+NATIONAL_PHONE = re.compile(r"\(?\d{3}\)?[ .-]?\d{3}[ .-]\d{4}")
+TRUNK_PREFIX = re.compile(r"\(0\)")
+NON_DIGITS = re.compile(r"\D")
+
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+
+def normalize_phone(raw, default_country_code=DEFAULT_COUNTRY_CODE, require_grouping=True):
+    """
+    Normalize a phone number to E.164 (+ and 8-15 digits), or return None
+
+    Numbers written without + or 00 get `default_country_code` if they have
+    the 10 digits of a national number and, unless `require_grouping` is
+    off (as for tel: links), are grouped like one; anything else is
+    rejected.
+    """
+    raw = TRUNK_PREFIX.sub("", raw.strip())
+    international = raw.startswith("+") or raw.startswith("00")
+    digits = NON_DIGITS.sub("", raw)
+    if raw.startswith("00"):
+        digits = digits[2:]
+    if not international:
+        if not default_country_code or len(digits) != 10:
+            return None
+        if require_grouping and not NATIONAL_PHONE.fullmatch(raw):
+            return None
+        digits = default_country_code + digits
+    if not 8 <= len(digits) <= 15 or digits[0] == "0":
+        return None
+    return f"+{digits}"
+
+
+def extract_contacts(text, mailto_links=(), default_country_code=DEFAULT_COUNTRY_CODE, tel_links=()):
+    """
+    Find emails and phone numbers in document text in a single pass
+
+    Returns (emails, phones): lowercased emails and E.164 phones, each
+    deduplicated in order of first appearance. `mailto_links` are the href
+    values of mailto: links, which may hold several comma-separated addresses.
+    `tel_links` are the href values of tel: links, whose numbers are taken
+    even when written as a bare run of digits.
+    """
+    emails = {}
+    phones = {}
+    for href in mailto_links:
+        for address in href[7:].split("?")[0].split(","):
+            address = address.strip().lower()
+            if CONTACT_PATTERN.fullmatch(address) and "@" in address:
+                emails.setdefault(address, None)
+    for href in tel_links:
+        phone = normalize_phone(href[4:].split(";")[0], default_country_code, require_grouping=False)
+        if phone:
+            phones.setdefault(phone, None)
+
+    for match in CONTACT_PATTERN.finditer(text):
+        email = match.group("email")
+        if email:
+            emails.setdefault(email.lower().strip("."), None)
+            continue
+        phone = normalize_phone(match.group("phone"), default_country_code)
+        if phone:
+            phones.setdefault(phone, None)
+    return list(emails), list(phones)
+
+
+def contacts_frame(emails, phones):
+    """
+    Turn extracted emails and phones into contact rows
+    """
+    contacts = []
+
+    # Combine emails and phones
+    for email in emails:
+        contacts.append({
+            "Name": "Unknown",  # Would need more complex parsing to extract names
+            "Email": email,
+            "Phone": "",
+            "WhatsApp": "",
+            "Language": "en",  # Default language
+            "Country": ""
+        })
+
+    for phone in phones:
+        contacts.append({
+            "Name": "Unknown",
+            "Email": "",
+            "Phone": phone,
+            "WhatsApp": phone,  # Assuming phone can be used for WhatsApp
+            "Language": "en",
+            "Country": ""
+        })
+
+    return pd.DataFrame(contacts)
+
+
+def parse_page(html, base_url=None):
+    """
+    Parse a page once and pull out its contacts and outgoing links
+
+    Returns a (contacts DataFrame, list of absolute link URLs) tuple.
+    """
+    soup = BeautifulSoup(html, HTML_PARSER)
+
+    mailto_links = []
+    tel_links = []
+    links = []
+    for link in soup.find_all('a', href=True):
+        href = link['href'].strip()
+        if href.lower().startswith('mailto:'):
+            mailto_links.append(href)
+        elif href.lower().startswith('tel:'):
+            tel_links.append(href)
+        elif base_url:
+            links.append(urldefrag(urljoin(base_url, href))[0])
+
+    # Separate text nodes so numbers in adjacent cells do not run together
+    emails, phones = extract_contacts(soup.get_text("\n"), mailto_links, tel_links=tel_links)
+    return contacts_frame(emails, phones), links
+
 
 def scrape_contacts(url):
     """
     Scrape contact information from a given URL
     """
     try:
-        response = requests.get(url)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Find emails
-        emails = []
-        email_pattern = r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}'
-        
-        # Look for emails in text
-        for text in soup.stripped_strings:
-            found_emails = re.findall(email_pattern, text)
-            emails.extend(found_emails)
-        
-        # Look for emails in href attributes
-        for link in soup.find_all('a'):
-            href = link.get('href', '')
-            if href.startswith('mailto:'):
-                emails.append(href[7:])
-        
-        # Find phone numbers (simplified pattern)
-        phones = []
-        phone_pattern = r'(\+\d{1,3}[-\.\s]??)?\(?\d{3}\)?[-\.\s]?\d{3}[-\.\s]?\d{4}'
-        
-        for text in soup.stripped_strings:
-            found_phones = re.findall(phone_pattern, text)
-            phones.extend(found_phones)
-        
-        # Create a dataframe
-        contacts = []
-        
-        # Combine emails and phones
-        for email in emails:
-            contacts.append({
-                "Name": "Unknown",  # Would need more complex parsing to extract names
-                "Email": email,
-                "Phone": "",
-                "WhatsApp": "",
-                "Language": "en",  # Default language
-                "Country": ""
-            })
-        
-        for phone in phones:
-            contacts.append({
-                "Name": "Unknown",
-                "Email": "",
-                "Phone": phone,
-                "WhatsApp": phone,  # Assuming phone can be used for WhatsApp
-                "Language": "en",
-                "Country": ""
-            })
-        
-        return pd.DataFrame(contacts)
-    
+        response = requests.get(url, timeout=REQUEST_TIMEOUT, headers={"User-Agent": USER_AGENT})
+        contacts, _ = parse_page(response.text, url)
+        return contacts
+
     except Exception as e:
         print(f"Error scraping website: {e}")
-        return pd.DataFrame()
\ No newline at end of file
+        return pd.DataFrame()
+
+
+class HostThrottle:
+    """
+    Spaces out requests to each host by at least `delay` seconds
+    """
+
+    def __init__(self, delay=HOST_DELAY):
+        self.delay = delay
+        self._next = {}
+        self._lock = threading.Lock()
+
+    def wait(self, host, delay=None):
+        delay = self.delay if delay is None else delay
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next.get(host, now))
+            self._next[host] = slot + delay
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class RobotsCache:
+    """
+    Fetches and caches robots.txt per host
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self._parsers = {}
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        parts = urlparse(url)
+        root = f"{parts.scheme}://{parts.netloc}"
+        with self._lock:
+            if root in self._parsers:
+                return self._parsers[root]
+        parser = RobotFileParser()
+        try:
+            response = self.session.get(f"{root}/robots.txt", timeout=REQUEST_TIMEOUT)
+            if response.status_code in (401, 403):
+                parser.disallow_all = True
+            elif response.status_code == 200:
+                parser.parse(response.text.splitlines())
+            else:
+                parser.allow_all = True
+        except requests.RequestException:
+            parser.allow_all = True
+        with self._lock:
+            self._parsers.setdefault(root, parser)
+            return self._parsers[root]
+
+    def allowed(self, url):
+        return self.get(url).can_fetch(USER_AGENT, url)
+
+    def crawl_delay(self, url):
+        return self.get(url).crawl_delay(USER_AGENT)
+
+
+def _fetch(session, url, throttle, robots):
+    """
+    Fetch one HTML page politely, returning its text or None
+    """
+    if robots and not robots.allowed(url):
+        return None
+    host = urlparse(url).netloc
+    delay = robots.crawl_delay(url) if robots else None
+    throttle.wait(host, max(throttle.delay, delay or 0))
+    try:
+        response = session.get(url, timeout=REQUEST_TIMEOUT)
+    except requests.RequestException as e:
+        print(f"Error fetching {url}: {e}")
+        return None
+    if response.status_code != 200 or "html" not in response.headers.get("Content-Type", ""):
+        return None
+    return response.text
+
+
+def crawl(seed_urls, max_depth=1, max_pages=100, same_domain=True, workers=CRAWL_WORKERS,
+          host_delay=HOST_DELAY, respect_robots=True):
+    """
+    Crawl outward from seed URLs, yielding (url, contacts DataFrame) per page
+
+    Pages are fetched concurrently by `workers` threads, but each host sees
+    at most one request every `host_delay` seconds (or its robots.txt
+    Crawl-delay, if longer). Links are followed up to `max_depth` hops from a
+    seed, only on the seeds' domains when `same_domain` is set, and each URL
+    is fetched at most once.
+    """
+    session = requests.Session()
+    session.headers["User-Agent"] = USER_AGENT
+    throttle = HostThrottle(host_delay)
+    robots = RobotsCache(session) if respect_robots else None
+    allowed_hosts = {urlparse(url).netloc for url in seed_urls}
+
+    seen = set()
+    frontier = deque()
+    for url in seed_urls:
+        url = urldefrag(url)[0]
+        if url not in seen:
+            seen.add(url)
+            frontier.append((url, 0))
+
+    started = 0
+    pending = {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="crawl") as executor:
+        while frontier or pending:
+            while frontier and len(pending) < workers and started < max_pages:
+                url, depth = frontier.popleft()
+                pending[executor.submit(_fetch, session, url, throttle, robots)] = (url, depth)
+                started += 1
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                url, depth = pending.pop(future)
+                html = future.result()
+                if html is None:
+                    continue
+                contacts, links = parse_page(html, url)
+                yield url, contacts
+
+                if depth >= max_depth:
+                    continue
+                for link in links:
+                    parts = urlparse(link)
+                    if parts.scheme not in ("http", "https") or link in seen:
+                        continue
+                    if same_domain and parts.netloc not in allowed_hosts:
+                        continue
+                    seen.add(link)
+                    frontier.append((link, depth + 1))
+
+
+def crawl_into_store(seed_urls, store, on_page=None, **crawl_options):
+    """
+    Crawl and add each page's contacts to a ContactStore as they arrive
+
+    `on_page(url, stats)` is called after every page, e.g. to show
+    progress. Returns counts of pages crawled, contacts found and new
+    contacts added.
+    """
+    stats = {"pages": 0, "found": 0, "added": 0}
+    for url, contacts in crawl(seed_urls, **crawl_options):
+        stats["pages"] += 1
+        if not contacts.empty:
+            stats["found"] += len(contacts)
+            stats["added"] += store.add(contacts)
+        if on_page:
+            on_page(url, stats)
+    return stats
@@ -0,0 +1,528 @@
+import hashlib
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+
+from delivery_log import RETRYING, get_delivery_log
+from dispatcher import FALLBACK, FALLBACK_ORDER, method_channels, recipient_for
+from suppression import get_recipient_index, normalize_identifier, screen_tasks
+
+QUEUE_PATH = "send_queue.db"
+# Seconds before an in-flight claim is considered abandoned and reclaimable
+LEASE_SECONDS = 900
+# Attempts before a message is left in the failed state
+MAX_ATTEMPTS = 3
+# Seconds before a failed send is retried, doubling with every attempt
+RETRY_BACKOFF = 15
+
+PENDING = "pending"
+IN_FLIGHT = "in_flight"
+SENT = "sent"
+FAILED = "failed"
+# Never sent because the recipient is suppressed or bounced
+SKIPPED = "skipped"
+# Parked because the provider was down; replayed in bulk once it recovers
+DEAD_LETTER = "dead_letter"
+STATES = (PENDING, IN_FLIGHT, SENT, FAILED, SKIPPED, DEAD_LETTER)
+
+# (recipient, channel) pairs checked against the delivered ledger per row:
+# every fallback channel, plus the fallback key older ledgers recorded
+LEDGER_KEYS = len(FALLBACK_ORDER) + 1
+
+
+def campaign_id(messages, method="all"):
+    """
+    Stable id for a list of messages sent with a method, so re-running the
+    same file is a no-op while sending it another way is a new campaign
+    """
+    encoded = json.dumps([method, messages], sort_keys=True, default=str).encode()
+    return hashlib.sha1(encoded).hexdigest()[:16]
+
+
+def content_version(message):
+    """
+    Version of what a message says: its template version, or a hash of the
+    greeting for messages generated before templates were versioned
+    """
+    return message.get("template") or hashlib.sha1(str(message.get("greeting", "")).encode()).hexdigest()[:12]
+
+
+def ledger_keys(message, channel, recipient):
+    """
+    Flat (recipient, channel) pairs under which the delivered ledger may
+    already hold this row's send, padded with NULLs to LEDGER_KEYS pairs
+
+    A fallback row counts as delivered if any of its reachable channels
+    was, whichever campaign or method delivered it.
+    """
+    if channel == FALLBACK:
+        keys = [
+            (normalize_identifier(address), reachable)
+            for reachable in FALLBACK_ORDER
+            for address in [recipient_for(message, reachable)]
+            if address
+        ]
+        keys.append((recipient, FALLBACK))
+    else:
+        keys = [(recipient, channel)]
+    keys += [(None, None)] * (LEDGER_KEYS - len(keys))
+    return [value for key in keys for value in key]
+
+
+def recipient_shard(recipient):
+    """
+    Stable shard number for a recipient, the same in every process and on every host
+    """
+    return zlib.crc32(str(recipient).encode())
+
+
+def provider_message_id(response_text):
+    """
+    Pull the provider's message id out of a send response's JSON, if there is one
+    """
+    try:
+        data = json.loads(response_text)
+    except (TypeError, ValueError):
+        return None
+    if isinstance(data, dict):
+        for key in ("idMessage", "id", "textId", "sid"):
+            if data.get(key):
+                return str(data[key])
+    return None
+
+
+class SendQueue:
+    """
+    Durable per-message send queue in SQLite (WAL mode)
+
+    Each (campaign, channel, recipient) is stored once with its state
+    (pending / in_flight / sent / failed), attempt count and provider message
+    id. Workers claim pending rows in batches; claims expire after
+    LEASE_SECONDS so a crashed worker's messages are picked up again.
+
+    Every sent (recipient, content version, channel) is also kept in a
+    delivered ledger that outlives campaigns, so a rerun with a grown or
+    edited contact list only queues the recipients that have not had this
+    content yet.
+    """
+
+    def __init__(self, path=None, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS,
+                 retry_backoff=RETRY_BACKOFF):
+        self.path = path or QUEUE_PATH
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=30000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "id INTEGER PRIMARY KEY, campaign TEXT NOT NULL, channel TEXT NOT NULL, "
+            "recipient TEXT NOT NULL, payload TEXT NOT NULL, state TEXT NOT NULL DEFAULT 'pending', "
+            "attempts INTEGER NOT NULL DEFAULT 0, provider_message_id TEXT, last_error TEXT, "
+            "claimed_by TEXT, claimed_at REAL, updated_at REAL NOT NULL, "
+            "not_before REAL NOT NULL DEFAULT 0, shard INTEGER NOT NULL DEFAULT 0, template TEXT, "
+            "UNIQUE (campaign, channel, recipient))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS delivered ("
+            "recipient TEXT NOT NULL, template TEXT NOT NULL, channel TEXT NOT NULL, "
+            "campaign TEXT, delivered_at REAL NOT NULL, "
+            "PRIMARY KEY (recipient, template, channel)) WITHOUT ROWID"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(messages)")}
+        if "not_before" not in columns:
+            self._conn.execute("ALTER TABLE messages ADD COLUMN not_before REAL NOT NULL DEFAULT 0")
+        if "shard" not in columns:
+            self._conn.execute("ALTER TABLE messages ADD COLUMN shard INTEGER NOT NULL DEFAULT 0")
+            self._conn.create_function("recipient_shard", 1, recipient_shard, deterministic=True)
+            self._conn.execute("UPDATE messages SET shard = recipient_shard(recipient)")
+        if "template" not in columns:
+            self._conn.execute("ALTER TABLE messages ADD COLUMN template TEXT")
+            self._conn.create_function(
+                "content_version", 1, lambda payload: content_version(json.loads(payload)), deterministic=True
+            )
+            self._conn.execute("UPDATE messages SET template = content_version(payload)")
+            self._conn.execute(
+                "INSERT OR IGNORE INTO delivered SELECT recipient, template, channel, campaign, updated_at "
+                "FROM messages WHERE state = ?",
+                (SENT,),
+            )
+        self._conn.execute("DROP INDEX IF EXISTS messages_state")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS messages_due ON messages (state, not_before, id)")
+
+    def enqueue(self, messages, method="all", campaign=None, send_at=None, shard=None):
+        """
+        Add one row per (message, channel) for a campaign
+
+        With method="fallback" each message gets a single row, keyed by its
+        first reachable address, that the dispatcher routes at send time;
+        it is skipped if any of its reachable channels was delivered.
+
+        `send_at` is a Unix timestamp before which the messages will not be
+        claimed, or a list of timestamps, one per message. `shard` is an
+        optional (index, count) pair; only recipients in that shard are
+        queued, so hosts with separate queues can split a campaign. Rows that
+        already exist are left untouched, so enqueueing the same campaign
+        twice never duplicates a send, and recipients that already received
+        the same content on a channel in any campaign are skipped. Returns
+        the campaign id.
+        """
+        campaign = campaign or campaign_id(messages, method)
+        now = time.time()
+        channels = method_channels(method)
+        if send_at is None or isinstance(send_at, (int, float)):
+            send_times = itertools.repeat(send_at or 0)
+        else:
+            send_times = send_at
+        rows = (
+            (campaign, channel, recipient, json.dumps(message, default=str), now, due, recipient_shard(recipient),
+             version, version, *ledger_keys(message, channel, recipient))
+            for message, due in zip(messages, send_times)
+            for version in [content_version(message)]
+            for channel in channels
+            for address in [recipient_for(message, channel)]
+            if address
+            for recipient in [normalize_identifier(address)]
+            if shard is None or recipient_shard(recipient) % shard[1] == shard[0]
+        )
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO messages "
+                    "(campaign, channel, recipient, payload, updated_at, not_before, shard, template) "
+                    "SELECT ?, ?, ?, ?, ?, ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM delivered WHERE template = ? AND ("
+                    + " OR ".join(["(recipient = ? AND channel = ?)"] * LEDGER_KEYS) + "))",
+                    rows,
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return campaign
+
+    @staticmethod
+    def _filter(campaign=None, shard=None):
+        # SQL conditions (each starting with AND) and parameters limiting a
+        # query to one campaign and/or one (index, count) shard
+        conditions = ""
+        params = []
+        if campaign:
+            conditions += " AND campaign = ?"
+            params.append(campaign)
+        if shard:
+            conditions += " AND shard % ? = ?"
+            params += [shard[1], shard[0]]
+        return conditions, params
+
+    def claim(self, batch_size, worker_id, campaign=None, shard=None):
+        """
+        Atomically claim up to `batch_size` due pending (or abandoned) messages
+
+        Messages are claimed in due-time order. With `shard` set to an
+        (index, count) pair, only recipients whose shard number falls in that
+        partition are claimed. Returns send tasks carrying their queue row id
+        under "queue_id" and their campaign under "campaign".
+        """
+        now = time.time()
+        campaign_filter, campaign_params = self._filter(campaign, shard)
+
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT id, campaign, channel, payload FROM messages "
+                    f"WHERE state = ? AND claimed_at < ?{campaign_filter} ORDER BY id LIMIT ?",
+                    [IN_FLIGHT, now - self.lease_seconds, *campaign_params, batch_size],
+                ).fetchall()
+                if len(rows) < batch_size:
+                    rows += self._conn.execute(
+                        "SELECT id, campaign, channel, payload FROM messages "
+                        f"WHERE state = ? AND not_before <= ?{campaign_filter} ORDER BY not_before, id LIMIT ?",
+                        [PENDING, now, *campaign_params, batch_size - len(rows)],
+                    ).fetchall()
+                self._conn.executemany(
+                    "UPDATE messages SET state = ?, claimed_by = ?, claimed_at = ?, "
+                    "attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                    [(IN_FLIGHT, worker_id, now, now, row[0]) for row in rows],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [
+            {"queue_id": row_id, "campaign": campaign, "channel": channel, "message": json.loads(payload)}
+            for row_id, campaign, channel, payload in rows
+        ]
+
+    def next_due(self, campaign=None, shard=None):
+        """
+        Timestamp of the earliest pending message, or None if nothing is
+        pending, optionally for one campaign and/or (index, count) shard
+        """
+        conditions, params = self._filter(campaign, shard)
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT MIN(not_before) FROM messages WHERE state = ?{conditions}", [PENDING, *params]
+            ).fetchone()
+        return row[0]
+
+    def campaigns(self):
+        """
+        Per-campaign message counts by state and the campaign's send window
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT campaign, state, COUNT(*), MIN(not_before), MAX(not_before) "
+                "FROM messages GROUP BY campaign, state"
+            ).fetchall()
+        campaigns = {}
+        for campaign, state, count, first_due, last_due in rows:
+            summary = campaigns.setdefault(
+                campaign,
+                {**dict.fromkeys(STATES, 0), "first_due": first_due, "last_due": last_due},
+            )
+            summary[state] = count
+            summary["first_due"] = min(summary["first_due"], first_due)
+            summary["last_due"] = max(summary["last_due"], last_due)
+        return campaigns
+
+    def renew(self, worker_id):
+        """
+        Extend the lease on every message this worker has in flight
+        """
+        with self._lock:
+            self._conn.execute(
+                "UPDATE messages SET claimed_at = ? WHERE state = ? AND claimed_by = ?",
+                (time.time(), IN_FLIGHT, worker_id),
+            )
+
+    def mark_sent(self, queue_id, worker_id, provider_id=None, channel=None, recipient=None):
+        """
+        Record a successful send and add it to the delivered ledger. Only the
+        worker holding the claim can mark it.
+
+        `channel` and `recipient` are the channel and normalized address the
+        message actually went out on, for fallback rows the dispatcher routed;
+        they default to the row's own.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                updated = self._conn.execute(
+                    "UPDATE messages SET state = ?, provider_message_id = ?, last_error = NULL, "
+                    "updated_at = ? WHERE id = ? AND state = ? AND claimed_by = ?",
+                    (SENT, provider_id, now, queue_id, IN_FLIGHT, worker_id),
+                ).rowcount
+                if updated:
+                    self._conn.execute(
+                        "INSERT OR IGNORE INTO delivered SELECT COALESCE(?, recipient), template, "
+                        "COALESCE(?, channel), campaign, ? FROM messages WHERE id = ?",
+                        (recipient, channel, now, queue_id),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def mark_failed(self, queue_id, worker_id, error, retry=True, final_state=FAILED):
+        """
+        Record a failed send
+
+        With `retry` the message goes back to pending, due again after
+        `retry_backoff` seconds doubled for every attempt so far, until
+        MAX_ATTEMPTS is reached; it then moves to `final_state`, e.g.
+        DEAD_LETTER when the provider was down. Without `retry` (the
+        provider rejected the message itself) it is failed at once. Returns
+        the state the message is left in.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE messages SET state = CASE WHEN ? AND attempts < ? THEN ? WHEN ? THEN ? ELSE ? END, "
+                "not_before = ? + ? * (1 << MAX(attempts - 1, 0)), last_error = ?, updated_at = ? "
+                "WHERE id = ? AND state = ? AND claimed_by = ?",
+                (retry, self.max_attempts, PENDING, retry, final_state, FAILED, now, self.retry_backoff, error,
+                 now, queue_id, IN_FLIGHT, worker_id),
+            )
+            row = self._conn.execute("SELECT state FROM messages WHERE id = ?", (queue_id,)).fetchone()
+        return row[0] if row else None
+
+    def next_retry(self, campaign=None, shard=None):
+        """
+        Timestamp at which the earliest failed-and-retrying message is due,
+        or None if no message is waiting to be retried
+        """
+        conditions, params = self._filter(campaign, shard)
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT MIN(not_before) FROM messages WHERE state = ? AND attempts > 0{conditions}",
+                [PENDING, *params],
+            ).fetchone()[0]
+
+    def mark_skipped(self, queue_id, worker_id, reason):
+        """
+        Record that a claimed message will not be sent, e.g. to a suppressed recipient
+        """
+        with self._lock:
+            self._conn.execute(
+                "UPDATE messages SET state = ?, last_error = ?, updated_at = ? "
+                "WHERE id = ? AND state = ? AND claimed_by = ?",
+                (SKIPPED, reason, time.time(), queue_id, IN_FLIGHT, worker_id),
+            )
+
+    def mark_dead_letter(self, queue_id, worker_id, error):
+        """
+        Park a message whose provider was unavailable, keeping the error for context
+        """
+        with self._lock:
+            self._conn.execute(
+                "UPDATE messages SET state = ?, last_error = ?, updated_at = ? "
+                "WHERE id = ? AND state = ? AND claimed_by = ?",
+                (DEAD_LETTER, error, time.time(), queue_id, IN_FLIGHT, worker_id),
+            )
+
+    def dead_letters(self, campaign=None):
+        """
+        Dead-lettered messages per campaign and channel, with the latest error
+        """
+        query = (
+            "SELECT campaign, channel, COUNT(*), MAX(updated_at), "
+            "(SELECT last_error FROM messages AS latest WHERE latest.state = messages.state "
+            "AND latest.campaign = messages.campaign AND latest.channel = messages.channel "
+            "ORDER BY updated_at DESC LIMIT 1) "
+            "FROM messages WHERE state = ?"
+        )
+        params = [DEAD_LETTER]
+        if campaign:
+            query += " AND campaign = ?"
+            params.append(campaign)
+        query += " GROUP BY campaign, channel ORDER BY MAX(updated_at) DESC"
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [
+            {"campaign": campaign, "channel": channel, "count": count, "parked_at": parked_at, "error": error}
+            for campaign, channel, count, parked_at, error in rows
+        ]
+
+    def replay_dead_letters(self, campaign=None, channel=None):
+        """
+        Return dead-lettered messages to pending with fresh attempts, due now
+
+        Returns the number of messages replayed.
+        """
+        query = ("UPDATE messages SET state = ?, attempts = 0, claimed_by = NULL, not_before = ?, "
+                 "updated_at = ? WHERE state = ?")
+        now = time.time()
+        params = [PENDING, now, now, DEAD_LETTER]
+        if campaign:
+            query += " AND campaign = ?"
+            params.append(campaign)
+        if channel:
+            query += " AND channel = ?"
+            params.append(channel)
+        with self._lock:
+            return self._conn.execute(query, params).rowcount
+
+    def counts(self, campaign=None):
+        """
+        Number of messages in each state, optionally for one campaign
+        """
+        query = "SELECT state, COUNT(*) FROM messages"
+        params = []
+        if campaign:
+            query += " WHERE campaign = ?"
+            params.append(campaign)
+        query += " GROUP BY state"
+        with self._lock:
+            counts = dict(self._conn.execute(query, params).fetchall())
+        return {state: counts.get(state, 0) for state in STATES}
+
+    def close(self):
+        self._conn.close()
+
+
+def default_worker_id():
+    return f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+def process_queue(queue, dispatcher, campaign=None, batch_size=100, worker_id=None, on_result=None,
+                  shard=None, delivery_log=None, recipient_index=None):
+    """
+    Claim and send queued messages until none are left, writing each result
+    back as it arrives and logging every attempt to the delivery log
+
+    Suppressed recipients are skipped, failures are retried after a backoff
+    that this call waits out, and messages whose provider is down end up in
+    the dead-letter state. `on_result(task, success, response_text)` gets
+    every outcome, with the queue row's state under "state". Returns the
+    number sent.
+    """
+    worker_id = worker_id or default_worker_id()
+    delivery_log = delivery_log or get_delivery_log()
+    recipient_index = recipient_index or get_recipient_index()
+    renew_every = queue.lease_seconds / 3
+    sent_count = 0
+    while True:
+        tasks = queue.claim(batch_size, worker_id, campaign, shard)
+        if not tasks:
+            delivery_log.flush()
+            retry_at = queue.next_retry(campaign, shard)
+            if retry_at is None:
+                return sent_count
+            time.sleep(max(0.0, retry_at - time.time()))
+            continue
+        renewed_at = time.monotonic()
+        tasks, skipped = screen_tasks(tasks, recipient_index)
+        for task, reason in skipped:
+            queue.mark_skipped(task["queue_id"], worker_id, reason)
+            delivery_log.record(
+                task["campaign"], recipient_for(task["message"], task["channel"]), task["channel"], None,
+                SKIPPED, error=reason,
+            )
+            if on_result:
+                on_result(dict(task, state=SKIPPED), False, f"Skipped: recipient {reason}")
+        for task, success, response_text in dispatcher.run(tasks):
+            provider_id = provider_message_id(response_text) if success else None
+            # `state` is where the row ends up; a failure that will be retried is left pending
+            if success:
+                queue.mark_sent(
+                    task["queue_id"], worker_id, provider_id, task["channel"],
+                    normalize_identifier(recipient_for(task["message"], task["channel"])),
+                )
+                sent_count += 1
+                status = state = SENT
+            elif task.get("unavailable") and not task.get("retry"):
+                queue.mark_dead_letter(task["queue_id"], worker_id, response_text)
+                status = state = DEAD_LETTER
+            else:
+                state = queue.mark_failed(
+                    task["queue_id"], worker_id, response_text, retry=task.get("retry", True),
+                    final_state=DEAD_LETTER if task.get("unavailable") else FAILED,
+                )
+                # Only a message's last attempt is logged as failed, so failures count messages
+                status = state if state in (FAILED, DEAD_LETTER) else RETRYING
+            delivery_log.record(
+                task["campaign"],
+                recipient_for(task["message"], task["channel"]),
+                task["channel"],
+                task.get("provider"),
+                status,
+                provider_message_id=provider_id,
+                latency_ms=task["latency"] * 1000 if task.get("latency") is not None else None,
+                error=None if success else response_text,
+            )
+            if on_result:
+                on_result(dict(task, state=state), success, response_text)
+            if time.monotonic() - renewed_at > renew_every:
+                queue.renew(worker_id)
+                renewed_at = time.monotonic()
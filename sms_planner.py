@@ -0,0 +1,170 @@
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+from dispatcher import PROVIDER_LIMITS
+from generator import render_template
+from translator import translate_templates
+
+# GSM 03.38 default alphabet, and the extension table whose characters
+# take two septets (an escape plus the character)
+GSM7_BASIC = (
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+GSM7_EXTENDED = "^{}\\[~]|€\f"
+GSM7_CHARS = frozenset(GSM7_BASIC + GSM7_EXTENDED)
+GSM7_PATTERN = "[" + re.escape(GSM7_BASIC + GSM7_EXTENDED) + "]*"
+EXTENDED_PATTERN = "[" + re.escape(GSM7_EXTENDED) + "]"
+# Characters outside the Basic Multilingual Plane take two UCS-2 code units
+ASTRAL_PATTERN = "[\U00010000-\U0010FFFF]"
+
+# Characters per segment: (single-part, per part of a multi-part message)
+GSM7_LIMITS = (160, 153)
+UCS2_LIMITS = (70, 67)
+
+GSM7 = "gsm7"
+UCS2 = "ucs2"
+
+# Approximate price per segment in USD; pass `segment_cost` for real rates
+SEGMENT_COSTS = {"twilio": 0.0083, "textbelt": 0.01, "textbee": 0.0}
+
+# Common typography that has a GSM-7 look-alike
+GSM7_SUBSTITUTES = str.maketrans({
+    "‘": "'", "’": "'", "“": '"', "”": '"', "–": "-", "—": "-",
+    "…": "...", " ": " ", "•": "*", "´": "'", "ʼ": "'",
+})
+
+
+def segment_counts(texts):
+    """
+    Encoding, length in encoding units and SMS segment count of each text
+
+    Texts made only of GSM-7 characters are counted in septets (extension
+    characters count twice); anything else is sent as UCS-2 and counted in
+    UTF-16 code units. Returns a DataFrame with encoding, units and
+    segments columns, aligned with `texts`.
+    """
+    texts = pd.Series(texts, dtype=object).fillna("").astype(str)
+    gsm = texts.str.fullmatch(GSM7_PATTERN).to_numpy(dtype=bool)
+    lengths = texts.str.len().to_numpy()
+    septets = lengths + texts.str.count(EXTENDED_PATTERN).to_numpy()
+    code_units = lengths + texts.str.count(ASTRAL_PATTERN).to_numpy()
+
+    units = np.where(gsm, septets, code_units)
+    single = np.where(gsm, GSM7_LIMITS[0], UCS2_LIMITS[0])
+    part = np.where(gsm, GSM7_LIMITS[1], UCS2_LIMITS[1])
+    segments = np.where(units <= single, 1, -(-units // part))
+    return pd.DataFrame(
+        {"encoding": np.where(gsm, GSM7, UCS2), "units": units, "segments": segments},
+        index=texts.index,
+    )
+
+
+def to_gsm7(text):
+    """
+    GSM-7-safe transliteration of a text, or None if it cannot be made GSM-7
+
+    Uses the optional `unidecode` package when installed; otherwise only
+    typography and accented Latin letters are folded.
+    """
+    text = text.translate(GSM7_SUBSTITUTES)
+    if re.fullmatch(GSM7_PATTERN, text):
+        return text
+    try:
+        from unidecode import unidecode
+    except ImportError:
+        # Fold only what GSM-7 lacks, so "è" stays while "ç" becomes "c"
+        folded = "".join(
+            char if char in GSM7_CHARS else "".join(
+                part for part in unicodedata.normalize("NFKD", char) if not unicodedata.combining(part)
+            )
+            for char in text
+        )
+    else:
+        folded = unidecode(text)
+    return folded if re.fullmatch(GSM7_PATTERN, folded) else None
+
+
+def sms_texts(messages):
+    """
+    The text each message would be sent as by SMS
+    """
+    if "sms_greeting" in messages:
+        return messages["sms_greeting"].where(messages["sms_greeting"].fillna("") != "", messages["greeting"])
+    return messages["greeting"]
+
+
+def prepare_sms(messages, transliterate=False, short_template=None, max_segments=1,
+                translate=translate_templates):
+    """
+    Fit SMS messages into fewer segments, in an "sms_greeting" column
+
+    With `transliterate`, UCS-2 messages that have a GSM-7 transliteration
+    use it. With `short_template`, messages still over `max_segments` are
+    re-rendered from the shorter template, translated once per language.
+    WhatsApp and email keep the full greeting. Returns a copy.
+    """
+    messages = pd.DataFrame(messages) if not isinstance(messages, pd.DataFrame) else messages.copy()
+    texts = sms_texts(messages).astype(object)
+    has_phone = messages["phone"].fillna("").astype(str) != "" if "phone" in messages else False
+
+    if transliterate:
+        ucs2 = has_phone & (segment_counts(texts)["encoding"] == UCS2)
+        converted = texts[ucs2].map(to_gsm7)
+        texts.loc[converted.dropna().index] = converted.dropna()
+
+    if short_template:
+        over = has_phone & (segment_counts(texts)["segments"] > max_segments)
+        if over.any():
+            pending = messages[over]
+            templates = translate(short_template, pending["language"].astype(str).unique())
+            for language, names in pending.groupby(pending["language"].astype(str), sort=False)["name"]:
+                texts.loc[names.index] = render_template(templates[language], names)
+            if transliterate:
+                converted = texts[over].map(to_gsm7)
+                texts.loc[converted.dropna().index] = converted.dropna()
+
+    messages["sms_greeting"] = texts
+    return messages
+
+
+def plan_sms(messages, provider="textbelt", limits=None, segment_cost=None):
+    """
+    Project segments, send time and cost of a campaign's SMS before it starts
+
+    Only messages with a phone number are counted. Duration assumes the
+    provider's rate limit applies per segment, as carrier throughput does.
+    Returns a summary dict with a per-language breakdown DataFrame under
+    "by_language".
+    """
+    if not isinstance(messages, pd.DataFrame):
+        messages = pd.DataFrame(messages)
+    if "phone" not in messages:
+        messages = messages.assign(phone="")
+    sms = messages[messages["phone"].fillna("").astype(str) != ""]
+    counts = segment_counts(sms_texts(sms)) if len(sms) else segment_counts([])
+    counts["language"] = sms["language"].astype(str) if "language" in sms else ""
+
+    rate = (limits or PROVIDER_LIMITS).get(provider, PROVIDER_LIMITS["textbelt"])["rate"]
+    cost = SEGMENT_COSTS.get(provider, 0.0) if segment_cost is None else segment_cost
+    segments = int(counts["segments"].sum())
+    by_language = counts.groupby("language").agg(
+        messages=("segments", "size"),
+        segments=("segments", "sum"),
+        ucs2=("encoding", lambda encodings: int((encodings == UCS2).sum())),
+        max_segments=("segments", "max"),
+    ).reset_index()
+    return {
+        "provider": provider,
+        "messages": len(counts),
+        "segments": segments,
+        "gsm7": int((counts["encoding"] == GSM7).sum()),
+        "ucs2": int((counts["encoding"] == UCS2).sum()),
+        "multipart": int((counts["segments"] > 1).sum()),
+        "duration_seconds": segments / rate if rate else None,
+        "cost": segments * cost,
+        "by_language": by_language,
+    }
@@ -0,0 +1,237 @@
+import hashlib
+import math
+import re
+import sqlite3
+import threading
+import time
+
+from dispatcher import CHANNEL_FIELDS, FALLBACK, FALLBACK_ORDER
+
+RECIPIENTS_PATH = "recipients.db"
+# Entries the in-memory Bloom filter is sized for before it is rebuilt larger
+BLOOM_CAPACITY = 1_000_000
+BLOOM_ERROR_RATE = 0.01
+# Keys per SQLite lookup when confirming Bloom filter hits
+LOOKUP_BATCH = 500
+
+SUPPRESSED = "suppressed"
+BOUNCED = "bounced"
+# Reasons that stop a send unless the caller asks otherwise
+BLOCKING_REASONS = (SUPPRESSED, BOUNCED)
+
+NON_DIGITS = re.compile(r"\D")
+
+
+def normalize_identifier(address):
+    """
+    Canonical form of an email address or phone number, for matching
+
+    Emails are trimmed and lowercased. Phone and WhatsApp numbers keep only
+    their digits behind a single "+", with a leading international 00
+    dropped, so "+1 (555) 010-0000" and "0015550100000" match.
+    """
+    address = str(address).strip()
+    if "@" in address:
+        return address.lower()
+    digits = NON_DIGITS.sub("", address)
+    if digits.startswith("00"):
+        digits = digits[2:]
+    return f"+{digits}" if digits else ""
+
+
+def identifier_key(identifier):
+    """
+    16-byte digest stored in place of the identifier itself
+    """
+    return hashlib.blake2b(identifier.encode(), digest_size=16).digest()
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over 16-byte keys, using double hashing
+    """
+
+    def __init__(self, capacity=BLOOM_CAPACITY, error_rate=BLOOM_ERROR_RATE):
+        self.capacity = max(1, capacity)
+        self.size = max(64, int(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        first = int.from_bytes(key[:8], "little")
+        step = int.from_bytes(key[8:16], "little") | 1
+        return [(first + i * step) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class RecipientIndex:
+    """
+    Persistent index of recipients that should not be sent to
+
+    Identifiers are normalized and stored only as 16-byte digests in SQLite,
+    with the reason they were added (suppressed, bounced or any other
+    label). An in-memory Bloom filter over every stored key answers most
+    lookups without touching the database; only its hits are confirmed
+    against SQLite, in batches. Changes committed by other processes are
+    picked up on the next lookup.
+    """
+
+    def __init__(self, path=None, capacity=BLOOM_CAPACITY):
+        self.path = path or RECIPIENTS_PATH
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS recipients ("
+            "key BLOB PRIMARY KEY, reason TEXT NOT NULL, added_at REAL NOT NULL) WITHOUT ROWID"
+        )
+        self._conn.commit()
+        self._load()
+
+    def _data_version(self):
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _load(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM recipients").fetchone()[0]
+        self._bloom = BloomFilter(max(self.capacity, count * 2))
+        for (key,) in self._conn.execute("SELECT key FROM recipients"):
+            self._bloom.add(key)
+        self._version = self._data_version()
+
+    def add(self, addresses, reason=SUPPRESSED):
+        """
+        Add addresses under `reason`, replacing any earlier reason. Returns
+        the number of addresses given that normalized to something.
+        """
+        now = time.time()
+        keys = {identifier_key(identifier) for identifier in map(normalize_identifier, addresses) if identifier}
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO recipients (key, reason, added_at) VALUES (?, ?, ?)",
+                    ((key, reason, now) for key in keys),
+                )
+            for key in keys:
+                self._bloom.add(key)
+            if self._bloom.count > self._bloom.capacity:
+                self._load()
+            self._version = self._data_version()
+        return len(keys)
+
+    def remove(self, addresses):
+        """
+        Take addresses off the index, e.g. after a recipient opts back in
+        """
+        keys = [(identifier_key(normalize_identifier(address)),) for address in addresses]
+        with self._lock:
+            with self._conn:
+                self._conn.executemany("DELETE FROM recipients WHERE key = ?", keys)
+            # A Bloom filter cannot forget keys, so rebuild it
+            self._load()
+
+    def lookup(self, addresses, reasons=BLOCKING_REASONS):
+        """
+        Map each given address whose identifier is in the index under one of
+        `reasons` (any reason if None) to that reason
+        """
+        with self._lock:
+            if self._data_version() != self._version:
+                self._load()
+            candidates = {}
+            for address in addresses:
+                identifier = normalize_identifier(address)
+                if identifier:
+                    key = identifier_key(identifier)
+                    if key in self._bloom:
+                        candidates.setdefault(key, []).append(address)
+
+            found = {}
+            keys = list(candidates)
+            for start in range(0, len(keys), LOOKUP_BATCH):
+                chunk = keys[start:start + LOOKUP_BATCH]
+                rows = self._conn.execute(
+                    f"SELECT key, reason FROM recipients WHERE key IN ({', '.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                for key, reason in rows:
+                    if reasons is None or reason in reasons:
+                        for address in candidates[key]:
+                            found[address] = reason
+        return found
+
+    def counts(self):
+        """
+        Number of indexed recipients by reason
+        """
+        with self._lock:
+            return dict(self._conn.execute("SELECT reason, COUNT(*) FROM recipients GROUP BY reason").fetchall())
+
+    def close(self):
+        self._conn.close()
+
+
+def screen_tasks(tasks, index, reasons=BLOCKING_REASONS):
+    """
+    Split send tasks into those still worth sending and those to skip
+
+    All addresses in the batch are looked up at once. Blocked addresses are
+    blanked on the task's message, so a fallback task simply skips the
+    channels it may not use. Returns (allowed, skipped), where skipped
+    holds (task, reason) pairs.
+    """
+    def channels(task):
+        return FALLBACK_ORDER if task["channel"] == FALLBACK else [task["channel"]]
+
+    addresses = {
+        task["message"][CHANNEL_FIELDS[channel]]
+        for task in tasks
+        for channel in channels(task)
+        if task["message"].get(CHANNEL_FIELDS[channel])
+    }
+    blocked = index.lookup(addresses, reasons) if addresses else {}
+    if not blocked:
+        return list(tasks), []
+
+    allowed, skipped = [], []
+    for task in tasks:
+        message = task["message"]
+        reasons_hit = [
+            blocked[message[CHANNEL_FIELDS[channel]]]
+            for channel in channels(task)
+            if message.get(CHANNEL_FIELDS[channel]) in blocked
+        ]
+        if not reasons_hit:
+            allowed.append(task)
+            continue
+        message = {
+            key: "" if key in CHANNEL_FIELDS.values() and value in blocked else value
+            for key, value in message.items()
+        }
+        if any(message.get(CHANNEL_FIELDS[channel]) for channel in channels(task)):
+            allowed.append(dict(task, message=message))
+        else:
+            skipped.append((task, reasons_hit[0]))
+    return allowed, skipped
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_recipient_index():
+    """
+    Return the process-wide recipient index, opened on first use
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = RecipientIndex()
+        return _index
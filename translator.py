@@ -1,34 +1,402 @@
+from concurrent.futures import ThreadPoolExecutor
+import re
+import sqlite3
+import threading
+import time
+
 import requests
 
-def translate_text(text, target_lang):
+from config import get_setting
+from metrics import track
+
+# Persistent translation cache settings
+CACHE_PATH = "translation_cache.db"
+CACHE_MAX_ENTRIES = 50000
+
+# LibreTranslate defaults; override with LIBRETRANSLATE_URL for a self-hosted instance
+LIBRETRANSLATE_URL = "https://libretranslate.de"
+TRANSLATION_BATCH_SIZE = 50
+REQUEST_TIMEOUT = (5, 30)
+# Languages translated in parallel
+TRANSLATION_WORKERS = 4
+
+# Matches template placeholders such as {name}
+PLACEHOLDER_PATTERN = re.compile(r"\{\w+\}")
+# Matches the opaque tokens placeholders are swapped for, tolerating spaces
+# that translation engines like to insert around punctuation
+TOKEN_PATTERN = re.compile(r"\[\s*\[\s*(\d+)\s*\]\s*\]")
+
+
+class TranslationCache:
     """
-    Translate text using LibreTranslate API
+    Persistent (source text, target language) -> translation cache.
+
+    Entries live in a small SQLite file so re-runs and scheduler jobs reuse
+    earlier translations. Once more than `max_entries` rows are stored, the
+    least recently used ones are evicted.
     """
-    try:
-        url = "https://libretranslate.de/translate"
-        data = {
-            "q": text,
-            "source": "auto",
-            "target": target_lang
-        }
-        response = requests.post(url, data=data)
-        if response.status_code == 200:
-            return response.json()["translatedText"]
-        return text
-    except Exception as e:
-        print(f"Translation error: {e}")
-        return text
+
+    def __init__(self, path=CACHE_PATH, max_entries=CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS translations ("
+            "source TEXT NOT NULL, target TEXT NOT NULL, translated TEXT NOT NULL, "
+            "last_used REAL NOT NULL, PRIMARY KEY (source, target))"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS translations_last_used ON translations (last_used)"
+        )
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+
+    def get(self, text, target_lang):
+        return self.get_many([text], target_lang).get(text)
+
+    def get_many(self, texts, target_lang):
+        """
+        Look up several texts at once, returning {text: translation} for hits
+        """
+        texts = list(dict.fromkeys(texts))
+        found = {}
+        with self._lock:
+            # Stay well under SQLite's bound-parameter limit
+            for start in range(0, len(texts), 500):
+                chunk = texts[start:start + 500]
+                marks = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT source, translated FROM translations WHERE target = ? AND source IN ({marks})",
+                    (target_lang, *chunk),
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE translations SET last_used = ? WHERE source = ? AND target = ?",
+                    [(now, text, target_lang) for text in found],
+                )
+                self._conn.commit()
+        return found
+
+    def set(self, text, target_lang, translated):
+        self.set_many({text: translated}, target_lang)
+
+    def set_many(self, translations, target_lang):
+        """
+        Store a {text: translation} mapping for one target language
+        """
+        with self._lock:
+            now = time.time()
+            for text, translated in translations.items():
+                exists = self._conn.execute(
+                    "SELECT 1 FROM translations WHERE source = ? AND target = ?",
+                    (text, target_lang),
+                ).fetchone()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO translations (source, target, translated, last_used) "
+                    "VALUES (?, ?, ?, ?)",
+                    (text, target_lang, translated, now),
+                )
+                if not exists:
+                    self._size += 1
+            if self._size > self.max_entries:
+                self._evict(self._size - self.max_entries)
+            self._conn.commit()
+
+    def _evict(self, count):
+        self._conn.execute(
+            "DELETE FROM translations WHERE rowid IN "
+            "(SELECT rowid FROM translations ORDER BY last_used LIMIT ?)",
+            (count,),
+        )
+        self._size -= count
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM translations")
+            self._conn.commit()
+            self._size = 0
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """
+    Return the process-wide translation cache, opening it on first use
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = TranslationCache(CACHE_PATH, CACHE_MAX_ENTRIES)
+        return _cache
+
+
+def set_cache(cache):
+    """
+    Replace the process-wide translation cache
+    """
+    global _cache
+    with _cache_lock:
+        _cache = cache
+
+
+class TranslationBackend:
+    """
+    Interface for translation engines
+
+    Backends translate lists of strings so callers can send many texts per
+    request. Subclasses implement `translate_batch`.
+    """
+
+    name = "base"
+
+    def translate_batch(self, texts, target_lang, source_lang="auto"):
+        """
+        Translate `texts` into `target_lang`, returning translations in the same order
+        """
+        raise NotImplementedError
+
+    def get_supported_languages(self):
+        return []
+
+
+class LibreTranslateBackend(TranslationBackend):
+    """
+    LibreTranslate over HTTP, public or self-hosted
+
+    Texts are sent as an array `q`, `batch_size` strings per request, over a
+    pooled keep-alive session.
+    """
+
+    name = "libretranslate"
+
+    def __init__(self, url=LIBRETRANSLATE_URL, api_key=None, batch_size=TRANSLATION_BATCH_SIZE,
+                 timeout=REQUEST_TIMEOUT):
+        self.url = url.rstrip("/")
+        self.api_key = api_key
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def translate_batch(self, texts, target_lang, source_lang="auto"):
+        translated = []
+        for start in range(0, len(texts), self.batch_size):
+            chunk = texts[start:start + self.batch_size]
+            payload = {
+                "q": chunk,
+                "source": source_lang,
+                "target": target_lang,
+                "format": "text"
+            }
+            if self.api_key:
+                payload["api_key"] = self.api_key
+            response = self.session.post(f"{self.url}/translate", json=payload, timeout=self.timeout)
+            response.raise_for_status()
+            result = response.json()["translatedText"]
+            translated.extend([result] if isinstance(result, str) else result)
+        return translated
+
+    def get_supported_languages(self):
+        response = self.session.get(f"{self.url}/languages", timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+
+class ArgosBackend(TranslationBackend):
+    """
+    In-process offline translation with Argos Translate, the engine behind
+    LibreTranslate. Language packages must be installed beforehand.
+    """
+
+    name = "argos"
+
+    def __init__(self):
+        import argostranslate.translate
+        self._translate = argostranslate.translate
+
+    def translate_batch(self, texts, target_lang, source_lang="auto"):
+        source = "en" if source_lang == "auto" else source_lang
+        return [self._translate.translate(text, source, target_lang) for text in texts]
+
+    def get_supported_languages(self):
+        return [
+            {"code": language.code, "name": language.name}
+            for language in self._translate.get_installed_languages()
+        ]
+
+
+class IdentityBackend(TranslationBackend):
+    """
+    Returns texts unchanged; for offline runs and benchmarks
+    """
+
+    name = "identity"
+
+    def translate_batch(self, texts, target_lang, source_lang="auto"):
+        return list(texts)
+
+
+BACKENDS = {
+    "libretranslate": LibreTranslateBackend,
+    "argos": ArgosBackend,
+    "identity": IdentityBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def create_backend(name=None, **kwargs):
+    """
+    Build a translation backend by name
+
+    Defaults to the TRANSLATION_BACKEND setting (environment, .env or
+    secrets.toml), then "libretranslate". The LibreTranslate backend reads
+    LIBRETRANSLATE_URL and LIBRETRANSLATE_API_KEY unless `url` / `api_key`
+    are passed.
+    """
+    name = (name or get_setting("TRANSLATION_BACKEND") or "libretranslate").lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown translation backend: {name}")
+    if name == "libretranslate":
+        kwargs.setdefault("url", get_setting("LIBRETRANSLATE_URL", LIBRETRANSLATE_URL))
+        kwargs.setdefault("api_key", get_setting("LIBRETRANSLATE_API_KEY"))
+    return BACKENDS[name](**kwargs)
+
+
+def get_backend():
+    """
+    Return the process-wide translation backend, creating it on first use
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = create_backend()
+        return _backend
+
+
+def set_backend(backend):
+    """
+    Replace the process-wide translation backend
+    """
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+
+def translate_batch(texts, target_lang, source_lang="auto"):
+    """
+    Translate a list of texts, consulting the on-disk cache first
+
+    Only cache misses reach the backend, deduplicated and in batches. If the
+    backend fails, the affected texts are returned untranslated and are not
+    cached.
+    """
+    texts = list(texts)
+    cache = get_cache()
+    translations = cache.get_many(texts, target_lang)
+    missing = [text for text in dict.fromkeys(texts) if text not in translations]
+
+    if missing:
+        try:
+            backend = get_backend()
+            with track("translate", backend.name, len(missing)):
+                translated = backend.translate_batch(missing, target_lang, source_lang)
+            fresh = dict(zip(missing, translated))
+            cache.set_many(fresh, target_lang)
+            translations.update(fresh)
+        except Exception as e:
+            print(f"Translation error: {e}")
+
+    return [translations.get(text, text) for text in texts]
+
+
+def translate_text(text, target_lang, source_lang="auto"):
+    """
+    Translate text using the configured backend, consulting the on-disk cache first
+    """
+    return translate_batch([text], target_lang, source_lang)[0]
+
+
+def protect_placeholders(template):
+    """
+    Swap {placeholders} for opaque [[n]] tokens that survive translation
+
+    Returns the protected text and the list of original placeholders, indexed
+    by token number.
+    """
+    placeholders = []
+
+    def _protect(match):
+        placeholders.append(match.group(0))
+        return f"[[{len(placeholders) - 1}]]"
+
+    return PLACEHOLDER_PATTERN.sub(_protect, template), placeholders
+
+
+def restore_placeholders(text, placeholders):
+    """
+    Put the original placeholders back in place of their [[n]] tokens
+
+    Returns None if any token was lost or mangled during translation.
+    """
+    seen = set()
+
+    def _restore(match):
+        index = int(match.group(1))
+        if index >= len(placeholders):
+            return match.group(0)
+        seen.add(index)
+        return placeholders[index]
+
+    restored = TOKEN_PATTERN.sub(_restore, text)
+    if len(seen) != len(placeholders):
+        return None
+    return restored
+
+
+def translate_template(template, target_lang, source_lang="en"):
+    """
+    Translate a greeting template once for a target language
+
+    Placeholders such as {name} are protected during translation so they can
+    be filled in per contact afterwards. If the translation drops a
+    placeholder, the untranslated template is returned.
+    """
+    if target_lang == source_lang:
+        return template
+
+    protected, placeholders = protect_placeholders(template)
+    translated = translate_text(protected, target_lang, source_lang)
+    restored = restore_placeholders(translated, placeholders)
+    if restored is None:
+        print(f"Translation to {target_lang} lost a placeholder, keeping original template")
+        return template
+    return restored
+
+
+def translate_templates(template, languages, source_lang="en"):
+    """
+    Translate a template into each distinct language, one translation per language
+
+    Languages are translated in parallel, at most TRANSLATION_WORKERS at a time.
+    """
+    languages = set(languages)
+    with ThreadPoolExecutor(max_workers=TRANSLATION_WORKERS) as executor:
+        translated = executor.map(lambda lang: translate_template(template, lang, source_lang), languages)
+        return dict(zip(languages, translated))
+
 
 def get_supported_languages():
     """
-    Get list of supported languages from LibreTranslate
+    Get list of supported languages from the configured backend
     """
     try:
-        url = "https://libretranslate.de/languages"
-        response = requests.get(url)
-        if response.status_code == 200:
-            return response.json()
-        return []
+        return get_backend().get_supported_languages()
     except Exception as e:
         print(f"Error getting languages: {e}")
-        return []
\ No newline at end of file
+        return []